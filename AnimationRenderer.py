@@ -0,0 +1,123 @@
+'''
+headless rendering of grid animations straight to a video or GIF file
+
+the figure lives on an Agg canvas (no display needed) and is drawn once; the static background
+(axes, ticks, colorbar) is cached, and each frame restores it, writes the colormapped grid
+straight into the pixels of the image area and redraws only the spines and the frame counter
+'''
+import shutil
+import subprocess
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
+
+
+
+class AnimationRenderer:
+    def __init__(self, grid_shape, cmap='coolwarm', vmin=0, vmax=1, figsize=(8,6), dpi=100, colorbar=True, title=None) -> None:
+        # the color scale is fixed up front since the colorbar is part of the cached background
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        ax = self.fig.add_subplot(111)
+        if title is not None:
+            ax.set_title(title)
+
+        # the image is only drawn once, for the background and colorbar; frames are written
+        # into its pixel area directly (see renderFrame) rather than through set_data
+        self.image = ax.matshow(np.zeros(grid_shape), cmap=cmap, vmin=vmin, vmax=vmax)
+        if colorbar:
+            self.fig.colorbar(self.image, ax=ax)
+        self.label = ax.annotate(
+            "", (0, 1), xycoords="axes fraction", xytext=(10, -10),
+            textcoords="offset points", ha="left", va="top", animated=True)
+        # the spines overlap the edge of the image area, so they are drawn over each frame
+        # like in a normal render instead of being baked into the background
+        self.spines = list(ax.spines.values())
+        for spine in self.spines:
+            spine.set_animated(True)
+
+        # full draw once and keep everything but the label and spines as the background
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.pixels = np.asarray(self.canvas.buffer_rgba())
+
+        # pixel edges of the grid cells; buffer rows run top-down while display y runs bottom-up
+        n_rows, n_cols = grid_shape
+        height = self.pixels.shape[0]
+        x_edges = ax.transData.transform(np.column_stack((np.arange(n_cols+1) - 0.5, np.zeros(n_cols+1))))[:,0]
+        y_edges = height - ax.transData.transform(np.column_stack((np.zeros(n_rows+1), np.arange(n_rows+1) - 0.5)))[:,1]
+        x_edges = np.round(x_edges).astype(int)
+        y_edges = np.round(y_edges).astype(int)
+        self.x_span = slice(x_edges[0], x_edges[-1])
+        self.y_span = slice(y_edges[0], y_edges[-1])
+        # cell of every pixel column / row of the image area
+        self.col_of_pixel = np.searchsorted(x_edges, np.arange(x_edges[0], x_edges[-1]), side='right') - 1
+        self.row_of_pixel = np.searchsorted(y_edges, np.arange(y_edges[0], y_edges[-1]), side='right') - 1
+
+
+    def renderFrame(self, grid, label=""):
+        # draws one frame and returns the canvas as an (height, width, 4) RGBA array view
+        self.canvas.restore_region(self.background)
+        colors = self.image.to_rgba(np.asarray(grid), bytes=True)
+        self.pixels[self.y_span, self.x_span] = colors[self.row_of_pixel][:, self.col_of_pixel]
+        for spine in self.spines:
+            self.fig.draw_artist(spine)
+        self.label.set_text(label)
+        self.fig.draw_artist(self.label)
+        return self.pixels
+
+
+    def save(self, frames, path, fps=30):
+        '''
+        Streams frames to path. frames is an iterable of grids or (grid, label) pairs.
+        .gif files are written with Pillow (which holds the frames until the file is closed);
+        anything else is piped to ffmpeg one raw frame at a time, so memory use stays flat.
+        Returns the number of frames written.
+        '''
+        frames = (f if isinstance(f, tuple) else (f, "") for f in frames)
+        if path.endswith(".gif"):
+            return self.saveGif(frames, path, fps)
+        return self.saveVideo(frames, path, fps)
+
+
+    def saveVideo(self, frames, path, fps):
+        if shutil.which("ffmpeg") is None:
+            raise RuntimeError("ffmpeg was not found on the PATH; save to a .gif instead")
+
+        width, height = self.canvas.get_width_height()
+        ffmpeg = subprocess.Popen([
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", "-vcodec", "libx264", path],
+            stdin=subprocess.PIPE)
+
+        count = 0
+        try:
+            for grid, label in frames:
+                ffmpeg.stdin.write(self.renderFrame(grid, label).tobytes())
+                count += 1
+        finally:
+            ffmpeg.stdin.close()
+            ffmpeg.wait()
+        return count
+
+
+    def saveGif(self, frames, path, fps):
+        # fast octree quantization is several times cheaper than Pillow's default palette search
+        images = (
+            Image.fromarray(self.renderFrame(grid, label)).convert("RGB").quantize(method=Image.Quantize.FASTOCTREE)
+            for grid, label in frames)
+        first = next(images, None)
+        if first is None:
+            return 0
+
+        count = 1
+        def counted(images):
+            nonlocal count
+            for image in images:
+                count += 1
+                yield image
+
+        first.save(path, save_all=True, append_images=counted(images), duration=int(1000 / fps), loop=0)
+        return count
@@ -1,14 +1,38 @@
+import time
 import numpy as np
 
+from TabularMDP import TabularMDP
+
 
 class DPGridworld:
-    def __init__(self) -> None:
-        self.theta = 0.01  # threshold to break out of policy eval loop
-        self.gridsize = 4
+    def __init__(self, gridsize=4, theta=0.01) -> None:
+        self.theta = theta  # threshold to break out of policy eval loop
+        self.gridsize = gridsize
 
         # the value of each state under the current policy
         self.state_values = np.zeros(shape=(self.gridsize, self.gridsize))
 
+        # flat neighbor indices [up,down,left,right] for every cell, computed once
+        # off-grid moves point back at the cell itself and get zero weight
+        n_states = self.gridsize**2
+        rows, cols = np.divmod(np.arange(n_states), self.gridsize)
+        nbr_rows = rows[:, None] + np.array([-1, 1, 0, 0])
+        nbr_cols = cols[:, None] + np.array([0, 0, -1, 1])
+        valid = (nbr_rows >= 0) & (nbr_rows < self.gridsize) & (nbr_cols >= 0) & (nbr_cols < self.gridsize)
+        self.nbr_index = np.where(valid, nbr_rows * self.gridsize + nbr_cols, np.arange(n_states)[:, None])
+
+        # equiprobable random policy over the valid moves of each cell
+        self.nbr_weights = valid / valid.sum(axis=1, keepdims=True)
+
+        # terminal states are the top left and bottom right corners
+        self.terminal = np.zeros(n_states, dtype=bool)
+        self.terminal[[0, n_states-1]] = True
+
+        # checkerboard coloring; neighbors always have opposite colors
+        # which lets an in-place (Gauss-Seidel) sweep run as two array updates
+        self.red = ((rows + cols) % 2 == 0) & ~self.terminal
+        self.black = ((rows + cols) % 2 == 1) & ~self.terminal
+
 
     def evaluatePolicy(self):
         count=0
@@ -45,8 +69,54 @@ class DPGridworld:
 
                     self.state_values[r, c] = new_v
 
-                    # update delta
-                    delta = abs(old_v-new_v)
+                    # update delta with the largest change over the whole sweep
+                    delta = max(delta, abs(old_v-new_v))
+
+            if delta < self.theta:
+                print(f"delta({round(delta, 5)}) < theta({round(self.theta, 5)}) after {count} iterations")
+                self.prettyPrintGrid()
+                break
+
+
+    def evaluatePolicyVectorized(self, in_place=False):
+        # same fixed point as evaluatePolicy, but each sweep is a few array operations
+        # in_place=False -> synchronous (Jacobi) backup from the previous sweep's values
+        # in_place=True  -> red-black (Gauss-Seidel) backup that reads values updated this sweep
+        v = self.state_values.reshape(-1)
+        reward = -1
+
+        count = 0
+        while True:
+            count += 1
+            old_v = v.copy()
+
+            if in_place:
+                for color in (self.red, self.black):
+                    v[color] = np.sum(self.nbr_weights[color] * (reward + v[self.nbr_index[color]]), axis=1)
+            else:
+                new_v = np.sum(self.nbr_weights * (reward + old_v[self.nbr_index]), axis=1)
+                v[~self.terminal] = new_v[~self.terminal]
+
+            delta = np.max(np.abs(v - old_v))
+            if delta < self.theta:
+                print(f"delta({round(delta, 5)}) < theta({round(self.theta, 5)}) after {count} iterations")
+                self.prettyPrintGrid()
+                break
+
+
+    def evaluatePolicySparse(self, mdp=None):
+        # synchronous evaluation of the random policy where each backup is a sparse matrix-vector product
+        if mdp is None:
+            mdp = self.buildMDP()
+        policy = mdp.uniformPolicy()
+        v = self.state_values.reshape(-1)
+
+        count = 0
+        while True:
+            count += 1
+            new_v = mdp.backup(v, gamma=1, policy=policy)
+            delta = np.max(np.abs(new_v - v))
+            v[:] = new_v
 
             if delta < self.theta:
                 print(f"delta({round(delta, 5)}) < theta({round(self.theta, 5)}) after {count} iterations")
@@ -54,6 +124,85 @@ class DPGridworld:
                 break
 
 
+    def evaluatePolicyPrioritized(self, mdp=None):
+        # prioritized sweeping: only back up states whose neighbors actually changed
+        if mdp is None:
+            mdp = self.buildMDP()
+
+        v, backups = mdp.prioritizedSweep(gamma=1, theta=self.theta, policy=mdp.uniformPolicy(), v=self.state_values.reshape(-1))
+        self.state_values = v.reshape(self.gridsize, self.gridsize)
+        print(f"{backups} state backups ({round(backups / mdp.n_states, 1)} sweeps worth)")
+        self.prettyPrintGrid()
+
+
+    def evaluatePolicyExact(self, mdp=None, method='auto'):
+        # solve (I - P_pi) v = r_pi for the random policy directly instead of sweeping
+        if mdp is None:
+            mdp = self.buildMDP()
+
+        v, method, elapsed, residual = mdp.solvePolicy(mdp.uniformPolicy(), gamma=1, method=method, theta=self.theta)
+        self.state_values = v.reshape(self.gridsize, self.gridsize)
+        print(f"{method} solve of {mdp.n_states} states in {round(elapsed, 4)}s with residual {residual:.2e}")
+        self.prettyPrintGrid()
+
+
+    def valueIteration(self, mdp=None):
+        # returns the greedy policy as a grid of action indices [up,down,left,right]
+        if mdp is None:
+            mdp = self.buildMDP()
+
+        start = time.perf_counter()
+        v, actions, sweeps = mdp.valueIteration(gamma=1, theta=self.theta, v=self.state_values.reshape(-1))
+        elapsed = time.perf_counter() - start
+
+        self.state_values = v.reshape(self.gridsize, self.gridsize)
+        print(f"value iteration: {sweeps} sweeps in {round(elapsed, 4)}s ({round(sweeps / elapsed)} sweeps/s)")
+        self.prettyPrintGrid()
+        return actions.reshape(self.gridsize, self.gridsize)
+
+
+    def policyIteration(self, mdp=None):
+        # returns the greedy policy as a grid of action indices [up,down,left,right]
+        if mdp is None:
+            mdp = self.buildMDP()
+
+        start = time.perf_counter()
+        v, actions, sweeps, improvements = mdp.policyIteration(gamma=1, theta=self.theta)
+        elapsed = time.perf_counter() - start
+
+        self.state_values = v.reshape(self.gridsize, self.gridsize)
+        print(f"policy iteration: {improvements} improvements, {sweeps} sweeps in {round(elapsed, 4)}s ({round(sweeps / elapsed)} sweeps/s)")
+        self.prettyPrintGrid()
+        return actions.reshape(self.gridsize, self.gridsize)
+
+
+    def prettyPrintPolicy(self, actions):
+        arrows = ["^", "v", "<", ">"]
+        for r in range(self.gridsize):
+            for c in range(self.gridsize):
+                if self.terminal[r*self.gridsize + c]:
+                    print("T", end=" ")
+                else:
+                    print(arrows[actions[r, c]], end=" ")
+            print()
+        print()
+
+
+    def buildMDP(self):
+        # compile the gridworld dynamics into a TabularMDP; actions are [up,down,left,right]
+        # off-grid moves are unavailable, so the random policy averages over the valid ones
+        n_states = self.gridsize**2
+        s, a = np.nonzero(self.nbr_weights > 0)
+        s, a = s[~self.terminal[s]], a[~self.terminal[s]]
+        action_mask = np.zeros((n_states, 4), dtype=bool)
+        action_mask[s, a] = True
+
+        return TabularMDP.fromTransitions(
+            n_states, 4, s, a, self.nbr_index[s, a],
+            prob=np.ones(len(s)), reward=-np.ones(len(s)),
+            action_mask=action_mask, terminal=self.terminal)
+
+
     def getValidMoves(self, r, c):
         moves = [(r-1,c),(r+1,c),(r,c-1),(r,c+1)]
         valid_moves = []
@@ -0,0 +1,74 @@
+'''
+exact distribution of the dealer's final total for each visible card, for an infinite deck
+
+both dealers in this repo follow the same rule with a different threshold:
+    total < stand_on -> hit
+    otherwise, if an ace is still counted as 11 -> count it as 1 and keep going
+    otherwise -> stick
+MC_Blackjack.playGame stands on 17 and blackjack.Dealer.turn hits while the total is 30 or less (stand_on=31)
+'''
+import functools
+import numpy as np
+
+# card probabilities indexed by card value (aces are 11)
+# MC_Blackjack draws 2-11 uniformly
+UNIFORM_CARDS = (0, 0) + (0.1,) * 10
+# blackjack.Deck deals the 13 ranks uniformly, so 10/J/Q/K make a 10 four times as likely
+SHOE_CARDS = (0, 0) + (1/13,) * 8 + (4/13, 1/13)
+
+
+@functools.lru_cache(maxsize=None)
+def dealerOutcomeTable(stand_on=17, card_probs=UNIFORM_CARDS):
+    '''
+    Returns an array of shape (12, stand_on+11); row u is the probability distribution of the
+    dealer's final total when the visible card is u. Totals above 21 are busts.
+    Computed once per (stand_on, card_probs) by dynamic programming over (total, aces counted as 11).
+    '''
+    n_totals = stand_on + 11
+    memo = {}
+
+    def final(total, aces):
+        # distribution of the final total from the dealer hand state (total, aces)
+        if (total, aces) in memo:
+            return memo[(total, aces)]
+        if total < stand_on:
+            dist = np.zeros(n_totals)
+            for card, p in enumerate(card_probs):
+                if p > 0:
+                    dist += p * final(total + card, aces + (card == 11))
+        elif aces > 0:
+            dist = final(total - 10, aces - 1)
+        else:
+            dist = np.zeros(n_totals)
+            dist[total] = 1
+        memo[(total, aces)] = dist
+        return dist
+
+    table = np.zeros((12, n_totals))
+    for up_card in range(2, 12):
+        # the hidden card is dealt before the rule is applied, like both dealers do
+        for card, p in enumerate(card_probs):
+            if p > 0:
+                table[up_card] += p * final(up_card + card, (up_card == 11) + (card == 11))
+
+    table.flags.writeable = False
+    return table
+
+
+@functools.lru_cache(maxsize=None)
+def expectedStandRewards(stand_on=17, card_probs=UNIFORM_CARDS):
+    '''
+    Returns an array of shape (32, 12): the expected w/l/d reward (1/-1/0) of a player who sticks
+    on total p against visible card u, i.e. P(dealer busts or ends below p) - P(dealer ends above p).
+    Totals above 21 are player busts and score -1.
+    '''
+    table = dealerOutcomeTable(stand_on, card_probs)
+    totals = np.arange(table.shape[1])
+    rewards = np.full((32, 12), -1.0)
+    for p in range(22):
+        win = table[:, (totals > 21) | (totals < p)].sum(axis=1)
+        lose = table[:, (totals <= 21) & (totals > p)].sum(axis=1)
+        rewards[p] = win - lose
+
+    rewards.flags.writeable = False
+    return rewards
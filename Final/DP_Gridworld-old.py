@@ -1,5 +1,10 @@
+import os
+import sys
 import numpy as np
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from TabularMDP import TabularMDP
+
 
 class DPGridworld:
     def __init__(self) -> None:
@@ -55,6 +60,52 @@ class DPGridworld:
                 break
 
 
+    def evaluatePolicySparse(self, mdp=None):
+        # same random-policy evaluation, sweeping the compiled MDP instead of the grid
+        if mdp is None:
+            mdp = self.buildMDP()
+        policy = mdp.uniformPolicy()
+        v = self.state_values.reshape(-1)
+
+        count = 0
+        while True:
+            count += 1
+            new_v = mdp.backup(v, gamma=1, policy=policy)
+            delta = np.max(np.abs(new_v - v))
+            v[:] = new_v
+
+            if delta < self.theta:
+                print(count)
+                print(f"delta={delta}")
+                self.prettyPrintGrid()
+                break
+
+
+    def buildMDP(self):
+        # one transition per valid move; actions are [up,down,left,right] as in getValidMoves
+        n_states = self.gridsize**2
+        terminal = np.zeros(n_states, dtype=bool)
+        terminal[[0, n_states-1]] = True
+
+        s, a, sp = [], [], []
+        action_mask = np.zeros((n_states, 4), dtype=bool)
+        for r in range(self.gridsize):
+            for c in range(self.gridsize):
+                if terminal[r*self.gridsize + c]:
+                    continue
+                moves = [(r-1,c),(r+1,c),(r,c-1),(r,c+1)]
+                for i, move in enumerate(moves):
+                    if move in self.getValidMoves(r, c):
+                        s.append(r*self.gridsize + c)
+                        a.append(i)
+                        sp.append(move[0]*self.gridsize + move[1])
+                        action_mask[r*self.gridsize + c, i] = True
+
+        return TabularMDP.fromTransitions(
+            n_states, 4, s, a, sp, prob=np.ones(len(s)), reward=-np.ones(len(s)),
+            action_mask=action_mask, terminal=terminal)
+
+
     def getValidMoves(self, r, c):
         moves = [(r-1,c),(r+1,c),(r,c-1),(r,c+1)]
         valid_moves = []
@@ -0,0 +1,73 @@
+'''
+greedy action selection with random tie-breaking that does not allocate in the step loop
+
+TieBreaker keeps a block of precomputed random noise; the max entries of a row are scored
+with the next noise row and the best score wins, so ties go to a uniformly random max entry.
+GreedyCache remembers the greedy action of every row of a Q table and only recomputes
+rows that have been invalidated since, i.e. rows whose values were updated.
+'''
+import numpy as np
+
+
+class TieBreaker:
+    def __init__(self, n_actions, block=4096, rng=None) -> None:
+        self.rng = np.random.default_rng() if rng is None else rng
+        # noise in (0, 1] so a max entry always outscores the zeroed non-max entries
+        self.noise = np.empty((block, n_actions))
+        self.refill()
+
+        # scratch buffers reused by argmax
+        self._is_max = np.empty(n_actions, dtype=bool)
+        self._scores = np.empty(n_actions)
+
+
+    def refill(self):
+        self.rng.random(out=self.noise)
+        np.subtract(1, self.noise, out=self.noise)
+        self.cursor = 0
+
+
+    def argmax(self, values):
+        # index of the highest value in a 1-D row with ties broken randomly
+        if self.cursor == len(self.noise):
+            self.refill()
+        np.equal(values, values.max(), out=self._is_max)
+        np.multiply(self._is_max, self.noise[self.cursor], out=self._scores)
+        self.cursor += 1
+        return int(self._scores.argmax())
+
+
+    def argmaxRows(self, values):
+        # argmax of every row of a 2-D batch with ties broken randomly
+        n = values.shape[0]
+        if n > len(self.noise):
+            # grow the block once so a batch always fits
+            self.noise = np.empty((n, self.noise.shape[1]))
+            self.refill()
+        elif self.cursor + n > len(self.noise):
+            self.refill()
+        noise = self.noise[self.cursor:self.cursor+n]
+        self.cursor += n
+        return np.argmax((values == values.max(axis=1, keepdims=True)) * noise, axis=1)
+
+
+
+class GreedyCache:
+    def __init__(self, q, tie_breaker=None) -> None:
+        # q is a 2-D (n_states, n_actions) array or view; updates to it must be followed by invalidate
+        self.q = q
+        self.tie_breaker = TieBreaker(q.shape[1]) if tie_breaker is None else tie_breaker
+        self.greedy = np.zeros(q.shape[0], dtype=np.int64)
+        self.dirty = np.ones(q.shape[0], dtype=bool)
+
+
+    def invalidate(self, s):
+        self.dirty[s] = True
+
+
+    def action(self, s):
+        # cached greedy action of row s; a tie keeps its random winner until the row changes
+        if self.dirty[s]:
+            self.greedy[s] = self.tie_breaker.argmax(self.q[s])
+            self.dirty[s] = False
+        return self.greedy[s]
@@ -1,185 +1,134 @@
 # programmed by Aubrey Birdwell
 # reworked gridworld
 
+import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 import random
 
-class Cell:
-    def __init__(self, position = (0,0), stateValue = 0, count = 0, policy = 'E'):                       
-        #self.action_choices = [(0,1), (0,-1), (1,0), (-1,0)]       
-        self.position = position
-        self.stateValue = stateValue
-        self.count = count
-        self.policy = policy
-        self.setDirections()
-        
-    #set the action direction coordinates for the cell
-    def setDirections(self):
-        self.N = tuple(map(sum, zip((-1,0), self.position)))
-        self.E = tuple(map(sum, zip((0,1), self.position)))
-        self.S = tuple(map(sum, zip((1,0), self.position)))
-        self.W = tuple(map(sum, zip((0,-1), self.position)))        
-
-    # different access to the action coordinates
-    # though still accessible by namespace.attribute
-    def actionPosition(self, action):
-        if action == 'N':
-            return self.N
-        if action == 'E':
-            return self.E
-        if action == 'S':
-            return self.S
-        if action == 'W':
-            return self.W
-
-    # simply returns all avail actions even if out of bounds?
-    # maybe an improvment would be to make out of bounds actions unavail
-    # then get rid of my out of bounds function in the gridworld class
-    def actionsAvail(self):
-        actions = []
-        actions.append(self.N)
-        actions.append(self.E)
-        actions.append(self.S)
-        actions.append(self.W)
-        return actions
-
-    # setter
-    def setStateVal(self, value):
-        self.stateValue = value
-        
-    #simple count function
-    def updateCount(self):
-        self.count = self.count + 1
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from TabularMDP import TabularMDP
 
-    # setter
-    def setPolicy(self, newPolicy):
-        self.policy = newPolicy
-
-    
 class GridWorld:
 
-    def __init__(self, theta = 0.1, gamma = 0.9):
+    # N,E,S,W offsets
+    directions = np.array([(-1,0), (0,1), (1,0), (0,-1)])
+    policy_names = ['N', 'E', 'S', 'W']
+
+    # jumps are (cell, landing cell, reward per move): every action from A / B lands on A' / B'
+    def __init__(self, theta = 0.1, gamma = 0.9, size = 5, jumps = (((0,1), (4,1), 10), ((0,3), (2,3), 5))):
 
         #only for grid world
-        self.width = 5
-        self.height = 5
+        self.width = size
+        self.height = size
         self.theta = theta
-        self.gamma = 0.9
-
-        #initialize the rows of cell objects
-        gridworld = []
-        for r in range(self.width):
-            row_cells = []
-            for c in range(self.height):
-                grid_cell = Cell((r,c),0,0,'E')
-                row_cells.append(grid_cell)
-            gridworld.append(row_cells)
-        self.grid = gridworld
+        self.gamma = gamma
+
+        # state values and policies live in flat arrays instead of Cell objects
+        # policy holds an index into policy_names
+        self.values = np.zeros(self.width * self.height)
+        self.policy = np.full(self.width * self.height, 1, dtype=np.int8)
+
+        # neighbor indices for every cell, computed once
+        # off grid moves point back at the cell itself and are flagged in out_of_bounds
+        rows, cols = np.divmod(np.arange(self.width * self.height), self.height)
+        nbr_rows = rows[:, None] + self.directions[:, 0]
+        nbr_cols = cols[:, None] + self.directions[:, 1]
+        self.out_of_bounds = (nbr_rows < 0) | (nbr_rows > self.width - 1) | (nbr_cols < 0) | (nbr_cols > self.height - 1)
+        self.nbr_index = np.where(self.out_of_bounds, rows[:, None] * self.height + cols[:, None], nbr_rows * self.height + nbr_cols)
+
+        # rewards summed over the 4 moves: -1 per out of bounds move and the jump reward per move from A / B
+        self.rewards = -1.0 * self.out_of_bounds.sum(axis=1)
+        self.backup_index = self.nbr_index.copy()
+        for (jump, land, reward) in jumps:
+            s = self.index(jump)
+            self.rewards[s] = 4 * reward
+            self.backup_index[s] = self.index(land)
+
+    # flat array index of a (row, col) cell
+    def index(self, cell):
+        return cell[0] * self.height + cell[1]
 
     # count the out of bounds cells
     def numOutOfBounds(self,cell):
-        actions = self.grid[cell[0]][cell[1]].actionsAvail()
-        cnt = 0
-        # check if in bounds
-        for a in actions:
-            if a[0] < 0 or a[0] > (self.width - 1):
-                cnt += 1
-            if a[1] < 0 or a[1] > (self.width - 1):
-                cnt += 1                    
-        return cnt
+        return int(self.out_of_bounds[self.index(cell)].sum())
 
     # sum of all nbrs state values
     # add self if out of bounds 
     def getNbrsStates(self, cell):
-        actions = self.grid[cell[0]][cell[1]].actionsAvail()
-        state = self.grid[cell[0]][cell[1]].stateValue
-        sumStates = 0
-        # check if in bounds
-        for a in actions:
-            if a[0] < 0 or a[0] > (self.width - 1):
-                sumStates += (1 * state)
-            elif a[1] < 0 or a[1] > (self.width - 1):
-                sumStates += (1 * state)
-            else:
-                sumStates += self.grid[a[0]][a[1]].stateValue
-        return sumStates
-
-    # rewards -1 out of bounds, 10 for (0,1) and 5 for (0,3), 0 all else
+        return self.values[self.nbr_index[self.index(cell)]].sum()
+
+    # rewards -1 out of bounds, the jump rewards for A and B, 0 all else
     def nbrsRewards(self, cell):
-        if cell == (0,1):
-            return 40
-        if cell == (0,3):
-            return 20
-        return -1 * self.numOutOfBounds(cell)
+        return self.rewards[self.index(cell)]
 
     # returns nbrs state values
     def nbrsValues(self, cell):
-        if cell == (0,1):
-            return 4 * self.grid[4][1].stateValue
-        if cell == (0,3):
-            return 4 * self.grid[2][3].stateValue
-        #otherwise
-        return self.getNbrsStates(cell)
+        return self.values[self.backup_index[self.index(cell)]].sum()
 
     # update cell instance state
     def updateCellState(self, cell):
-        r = cell[0]
-        c = cell[1]
-        value = 0.25 * (self.nbrsRewards((r,c)) + (self.gamma * self.nbrsValues((r,c))))
-        self.grid[r][c].setStateVal(value)
+        value = 0.25 * (self.nbrsRewards(cell) + (self.gamma * self.nbrsValues(cell)))
+        self.values[self.index(cell)] = value
 
     # update cell policy
     def updateCellPolicy(self, cell):
-        r = cell[0]
-        c = cell[1]
-        actions = self.grid[r][c].actionsAvail()
-        values = []
-        # check if in bounds
-        for a in actions:
-            if a[0] < 0 or a[0] > (self.width - 1):                
-                values.append(-99)
-            elif a[1] < 0 or a[1] > (self.width - 1):
-                values.append(-99)
-            else:
-                values.append(self.grid[a[0]][a[1]].stateValue)
-        maxval = max(values)
-        maxpos = values.index(maxval)
-        self.setPolicy(r, c, maxpos)
-
-    # change 0-3 into N,E,S,W and access the setter in the cell class
+        s = self.index(cell)
+        values = np.where(self.out_of_bounds[s], -99, self.values[self.nbr_index[s]])
+        self.policy[s] = np.argmax(values)
+
+    # change 0-3 into N,E,S,W
     def setPolicy(self, r, c, p):
-        if p == 0:
-            policy = 'N'
-        if p == 1:
-            policy = 'E'
-        if p == 2:
-            policy = 'S'
-        if p == 3:
-            policy = 'W'
-        self.grid[r][c].setPolicy(policy)
-
-    # update all cells in rows and cols
+        self.policy[self.index((r,c))] = p
+
+    # greedy policy for every cell from the neighbor values; off grid moves score -99
+    def extractPolicy(self):
+        nbr_values = np.where(self.out_of_bounds, -99, self.values[self.nbr_index])
+        self.policy[:] = np.argmax(nbr_values, axis=1)
+
+    # update all cells in one synchronous backup, then the policy
     def updateGrid(self):
-        for r in range(self.width):
-            for c in range(self.height):
-                self.updateCellState((r,c))
-                self.updateCellPolicy((r,c))
+        self.values = 0.25 * (self.rewards + self.gamma * self.values[self.backup_index].sum(axis=1))
+        self.extractPolicy()
+
+    # compile the dynamics used by updateGrid into a TabularMDP
+    # actions are N,E,S,W; off grid costs -1 and stays put, A and B jump to A' and B'
+    def buildMDP(self):
+        n_states = self.width * self.height
+        s = np.repeat(np.arange(n_states), 4)
+        a = np.tile(np.arange(4), n_states)
+        sp = self.backup_index.reshape(-1)
+        # every action from A / B shares the jump reward
+        reward = np.where(self.out_of_bounds, -1.0, 0.0)
+        jumps = (self.backup_index != self.nbr_index).any(axis=1)
+        reward[jumps] = self.rewards[jumps, None] / 4
+        return TabularMDP.fromTransitions(n_states, 4, s, a, sp, np.ones(len(s)), reward.reshape(-1))
+
+    # update all cells with one synchronous sweep of a compiled MDP
+    def updateGridMDP(self, mdp):
+        self.values = mdp.backup(self.values, self.gamma, mdp.uniformPolicy())
+        self.extractPolicy()
+
+    # run prioritized sweeping on a compiled MDP until no cell is off by more than theta
+    # only cells whose neighbors changed get backed up again
+    def updateGridPrioritized(self, mdp):
+        self.values, backups = mdp.prioritizedSweep(self.gamma, self.theta, mdp.uniformPolicy(), self.values)
+        self.extractPolicy()
+        return backups
 
     # print the updated grid...
     def showGridWorld(self):        
         for r in range(self.width):
             row = []
             for c in range(self.height):
-                row.append((round(self.grid[r][c].stateValue, 1),self.grid[r][c].policy))
-                #print(self.grid[r][c].position)
+                s = self.index((r,c))
+                row.append((round(float(self.values[s]), 1), self.policy_names[self.policy[s]]))
             print(row)
 
 
 if __name__ == '__main__':
 
-    cell1 = Cell()
-
     sim = GridWorld()
     for i in range(19):
         sim.updateGrid()
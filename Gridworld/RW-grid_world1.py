@@ -6,10 +6,15 @@ each action
 
 '''
 
+import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 import random
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from TabularMDP import TabularMDP
+
 
 class Grid_Cell:
     '''
@@ -23,21 +28,33 @@ class Grid_Cell:
     S = 3
     global actions
     actions = [N, E, W, S]
+    # (dx, dy) for each action; y grows downwards
+    moves = [(0, -1), (1, 0), (-1, 0), (0, 1)]
 
-    def __init__(self, x, y):
+    def __init__(self, x, y, size=5):
         self.x = x
         self.y = y
+        self.size = size
         self.value = 0
 
     def list_rewards(self):
-        'returns a list of tuples (reward, next state, probability) '
+        'returns a list of tuples (reward, next state, probability), one per action '
         ret_val = []
         for a in actions:
-            # left border
-            # bottom border
-            # right border
-            if self.x != 1 or self.y != 0:
-                ret_val.append((0, 0.25))
+            if self.x == 1 and self.y == 0:
+                # A -> A'
+                ret_val.append((10, (1, 4), 0.25))
+            elif self.x == 3 and self.y == 0:
+                # B -> B'
+                ret_val.append((5, (3, 2), 0.25))
+            else:
+                dx, dy = self.moves[a]
+                x, y = self.x + dx, self.y + dy
+                # left, right, top and bottom borders
+                if x < 0 or x >= self.size or y < 0 or y >= self.size:
+                    ret_val.append((-1, (self.x, self.y), 0.25))
+                else:
+                    ret_val.append((0, (x, y), 0.25))
 
         return ret_val
 
@@ -48,6 +65,20 @@ class Grid_Cell:
         return self.value
 
 
+def compile_mdp(size=5):
+    'builds the TabularMDP for the grid from the Grid_Cell dynamics; state index is y * size + x '
+    s, a, sp, reward = [], [], [], []
+    for y in range(size):
+        for x in range(size):
+            cell = Grid_Cell(x, y, size)
+            for action, (r, (next_x, next_y), _) in zip(actions, cell.list_rewards()):
+                s.append(y * size + x)
+                a.append(action)
+                sp.append(next_y * size + next_x)
+                reward.append(r)
+    return TabularMDP.fromTransitions(size * size, len(actions), s, a, sp, np.ones(len(s)), reward)
+
+
 class gridworld:
     def __init__(self, x=5, y=5): 
         self.grid = np.zeros((x, y)) 
@@ -1,6 +1,11 @@
+import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from GreedySelection import TieBreaker
+
 '''
 create grid
 create grid values/probabilities; 4 for each cell (u,d,l,r)
@@ -15,6 +20,7 @@ class Gridworld:
         self.gamma = 0.9
 
         self.policy_grid = np.zeros((self.g_s+2, self.g_s+2, 4)) # [row][column][up,down,left,right]; +2 for grid border
+        self.tie_breaker = TieBreaker(4)
 
         # self.reward_grid = np.zeros((self.g_s+2, self.g_s+2))
         # # set border to -1
@@ -58,8 +64,7 @@ class Gridworld:
                 action_values[i] = self.estimateActionValue(a)
             
             # randomly choose index of most valuable action
-            bool_max = (action_values == action_values.max())
-            mva = np.argmax(bool_max * np.random.random(bool_max.shape))
+            mva = self.tie_breaker.argmax(action_values)
 
             # s' is the tuple coordinates of the mva
             sp = actions[mva]
@@ -1,19 +1,33 @@
+import os
+import sys
+import time
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from mpl_toolkits.axes_grid1.axes_divider import make_axes_locatable
 import numpy as np
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from GreedySelection import TieBreaker
+from TrajectoryRecorder import TrajectoryRecorder
+from AnimationRenderer import AnimationRenderer
+from GridworldTD import GridworldTD
 
-class Gridworld:
-    def __init__(self, grid_size=10, random_start=False, animate=False, final_image=True):
+
+class Gridworld(GridworldTD):
+    def __init__(self, grid_size=10, random_start=False, animate=False, final_image=True, value_stride=1, max_frames=None, max_episode_steps=None):
         self.grid_size = grid_size
         self.random_start = random_start
         self.gamma = 0.99 # discount
+        self.alpha = 0.1 # step size
         self.animate = animate
         self.final_image = final_image
+        # a greedy agent can oscillate without ever reaching A' or B'; max_episode_steps opts in to cutting
+        # episodes off after that many moves (None: no cap)
+        self.max_episode_steps = max_episode_steps
 
         # [row][column][up,down,left,right]; +2 for grid border
         self.action_values = np.zeros((self.grid_size+2, self.grid_size+2, 4)) 
+        self.tie_breaker = TieBreaker(4)
 
         # when the agent moves to A/B, the next move must be to A'/B' and will reward 10/5
         self.A = (1, 1) # top left of actual grid
@@ -21,25 +35,22 @@ class Gridworld:
         self.B = (1, self.grid_size - 2) # -1 for indexing and -1 for border
         self.Bp = (self.B[0]+2, self.B[1])
 
+        self.compileGrid()
+
         if self.animate:
-            # 3D array with form [iteration, row, column] where value is the sum of all the action values (-1 dimension of policy)
-            self.value_grid_iterations = np.sum(np.expand_dims(self.action_values, axis=0), axis=-1)
-            self.agent_path = np.array([1,1]).reshape((1,2))
+            # agent positions every step and a value grid (the sum of all the action values) every value_stride steps
+            # max_frames keeps only the latest steps in a fixed size ring buffer
+            self.recorder = TrajectoryRecorder(self.action_values.shape[:2], value_stride=value_stride, max_steps=max_frames)
 
 
     def animationBuilder(self, r, c):
-        # sum state/action values as "state_value_grid" 
-        state_value_grid = np.sum(self.action_values, axis=-1)
-
-        # add dimension to current state value grid to stack with previous value grids
-        vg_reshaped = np.expand_dims(state_value_grid, axis=0)
-        
-        # stack all value grids) with current value grid
-        self.value_grid_iterations = np.concatenate((self.value_grid_iterations, vg_reshaped))
+        # sum state/action values as "state_value_grid", but only on the steps that keep a snapshot
+        state_value_grid = None
+        if self.recorder.snapshotDue():
+            state_value_grid = self.state_sums.reshape(self.action_values.shape[:2])
 
-        # complete path of agent over simulation; initialized in simulate()
-        agent_location = np.array([r,c]).reshape((1,2))
-        self.agent_path = np.concatenate((self.agent_path, agent_location))
+        # complete path of agent over simulation
+        self.recorder.record(r, c, state_value_grid)
 
     
     def showAnimation(self):
@@ -49,23 +60,45 @@ class Gridworld:
 
         div = make_axes_locatable(ax)
         cax = div.append_axes('right', '5%', '5%')
-        print(self.value_grid_iterations[-1])
+        if self.recorder.snapshots:
+            print(self.recorder.snapshots[-1])
 
-        def animate(frame):
-            r, c = self.agent_path[frame]
-            grid_with_agent = self.value_grid_iterations[frame]
-            grid_with_agent[r,c] = grid_with_agent.max()
+        # one image artist and one colorbar over the value range of the whole run
+        vmin, vmax = self.valueRange()
+        im = ax.matshow(np.zeros(self.action_values.shape[:2]), cmap='coolwarm', vmin=vmin, vmax=vmax)
+        fig.colorbar(im, cax=cax)
 
-            im = ax.matshow(grid_with_agent, cmap='coolwarm')
-            cax.cla()
-            fig.colorbar(im, cax=cax)
+        def animate(frame):
+            im.set_data(frame[0])
             return im,
 
-        ani = FuncAnimation(fig, animate, frames=self.value_grid_iterations.shape[0], interval=10, blit=True)
-        # ani.save("gw3-animation.mp4")
+        ani = FuncAnimation(fig, animate, frames=self.agentFrames, save_count=len(self.recorder), interval=10, blit=True)
         plt.show()
 
 
+    def valueRange(self):
+        # smallest and largest recorded state value, used as a fixed color scale
+        if not self.recorder.snapshots:
+            return 0, 1
+        return min(v.min() for v in self.recorder.snapshots), max(v.max() for v in self.recorder.snapshots)
+
+
+    def agentFrames(self, every=1):
+        # yields (value grid with the agent's cell set to the max value, label) for every recorded step
+        for step, (r, c), values in self.recorder.frames():
+            if step % every == 0:
+                grid_with_agent = values.copy()
+                grid_with_agent[r,c] = grid_with_agent.max()
+                yield grid_with_agent, f"step {step}"
+
+
+    def saveAnimation(self, path, fps=30, every=1):
+        # renders the recorded run to a video (e.g. .mp4) or .gif without a display
+        vmin, vmax = self.valueRange()
+        renderer = AnimationRenderer(self.action_values.shape[:2], cmap='coolwarm', vmin=vmin, vmax=vmax, title="Gridworld")
+        return renderer.save(self.agentFrames(every), path, fps)
+
+
     def showFinalValues(self):
         cell_values = self.action_values[1:-1,1:-1].sum(axis=-1)
         np.set_printoptions(precision=3, suppress=True)
@@ -106,101 +139,124 @@ class Gridworld:
         plt.show()
 
 
-    def episode(self):
+    def compileGrid(self):
+        '''
+        Precomputes flat lookups for the step loop; state s is the cell r*(grid_size+2) + c:
+            neighbors[s]   flat cells reached by [up,down,left,right]; s itself where that move
+                           would enter the border, since the agent bounces off and stays
+            border[s]      True for the border cells
+            state_sums[s]  sum of the action values of s, kept in step with every update
+        '''
+        n = self.action_values.shape[1]
+        states = np.arange(n*n)
+        rows, cols = np.divmod(states, n)
+        self.border = (rows == 0) | (rows == n-1) | (cols == 0) | (cols == n-1)
+        # border cells are never occupied, so clipping their out of range neighbors is harmless
+        self.neighbors = np.clip(np.column_stack((states-n, states+n, states-1, states+1)), 0, n*n-1)
+        # a bounce leaves the agent where it is, so the mva judges it by the value of s itself
+        self.neighbors = np.where(self.border[self.neighbors], states[:, np.newaxis], self.neighbors)
+
+        # flat view of action_values; updates through it show up in action_values
+        self.q = self.action_values.reshape(-1, 4)
+        self.state_sums = self.q.sum(axis=1)
+        self._nearby = np.empty(4)
+
+        self.A_s, self.Ap_s = self.A[0]*n + self.A[1], self.Ap[0]*n + self.Ap[1]
+        self.B_s, self.Bp_s = self.B[0]*n + self.B[1], self.Bp[0]*n + self.Bp[1]
+
+
+    def flatMVA(self, s):
+        # the neighbor of flat state s with the largest summed action values, ties broken randomly
+        np.take(self.state_sums, self.neighbors[s], out=self._nearby)
+        return self.tie_breaker.argmax(self._nearby)
+
+
+    def episode(self, max_steps=None, deadline=None):
+        '''
+        Runs one episode until A' or B' is reached, max_steps moves have been made, or
+        time.perf_counter() passes deadline (checked every 1024 moves).
+        Returns (number of moves, True if the episode was cut off).
+        '''
+        n = self.action_values.shape[1]
+        q = self.q
+        state_sums = self.state_sums
+
         if self.random_start:
             # start in random spot (not on border)
             r, c = np.random.randint(low=1, high=self.grid_size+1, size=2)
+            s = int(r)*n + int(c)
         else:
-            r,c = self.grid_size - 1, self.grid_size // 2
-        
-        count = -1
-        # explore the board for T steps
-        while True:
-            count += 1
-            reward = 0
+            s = (self.grid_size - 1)*n + self.grid_size // 2
 
+        # moves so far
+        count = 0
+        # explore the board until A' or B' is reached
+        while True:
             if self.animate:
-                self.animationBuilder(r, c)
-
-            if (r,c) == self.Ap:
-                # agent just moved to A' -> end episode
-                break
-            elif (r,c) == self.Bp:
-                # '' ''         B'
-                break
+                self.animationBuilder(*divmod(s, n))
 
+            if s == self.Ap_s or s == self.Bp_s:
+                # agent just moved to A' or B' -> end episode
+                return count, False
+            if count == max_steps:
+                # move budget used up -> cut the episode off
+                return count, True
+            if deadline is not None and count % 1024 == 0 and time.perf_counter() > deadline:
+                return count, True
 
             ### core SARSA loop
             #------------------#
-            actions = self.getActions(r,c)
-
-            if (r,c) == self.A: # agent at A
-                # now moves to A' with reward = 10
-                reward = 10
-                sp_actions = self.getActions(self.Ap[0], self.Ap[1])
-                sp_mva = self.getMVA(sp_actions)
-                self.action_values[r,c,:] += (self.gamma**count * reward + self.action_values[self.Ap[0], self.Ap[1], sp_mva]) / 4
-                r,c = self.Ap
-                continue
-            elif (r,c) == self.B: # agent at B
-                # now moves to B' with reward = 5
-                reward = 5
-                sp_actions = self.getActions(self.Bp[0], self.Bp[1])
-                sp_mva = self.getMVA(sp_actions)
-                self.action_values[r,c,:] += (self.gamma**count * reward + self.action_values[self.Bp[0], self.Bp[1], sp_mva]) / 4
-                r,c = self.Bp
-                continue
-            # elif np.random.rand() < 0.1: # random choice
-            #     mva = np.random.randint(actions.shape[0])
-            #     sp = actions[mva]
-            else: # greedy choice
-                # s' is the tuple coordinates of the mva
-                mva = self.getMVA(actions)
-                sp = actions[mva]
-
-            # check to see if s' contains indices that place it in the border (0 or gridsize - 1)
-            if self.outOfBounds(sp):
-                # don't move but update the policy for that state/action pair
-                reward = -1
-                self.action_values[r,c,mva] += self.gamma**count * reward
+            # q(s,a) += alpha * (reward + gamma * q(s',a') - q(s,a)) with a' the mva of s';
+            # a bounded step towards the target, so values stay within max reward / (1 - gamma)
+            if s == self.A_s or s == self.B_s:
+                # agent at A/B now moves to A'/B' with reward = 10/5, whatever the action
+                sp, reward = (self.Ap_s, 10) if s == self.A_s else (self.Bp_s, 5)
+                update = self.alpha * (reward + self.gamma * q[sp, self.flatMVA(sp)] - q[s])
+                q[s] += update
+                state_sums[s] += update.sum()
+                s = sp
             else:
-                # move to s' (not A,B,or out of bounds)
-                reward = 0
-                self.updateActionValues(r, c, mva, sp, reward, count)
-                self.action_values[r,c,mva] += self.gamma**count * reward + self.action_values[sp[0], sp[1], sp_mva]
-                r,c = sp
+                # greedy choice; s' is the neighbor of the mva
+                mva = self.flatMVA(s)
+                sp = self.neighbors[s, mva]
+
+                # s' == s: the agent tried to move out of bounds and stays, reward = -1
+                # otherwise it moves to s' (not A,B,or out of bounds), reward = 0
+                reward = -1 if sp == s else 0
+                update = self.alpha * (reward + self.gamma * q[sp, self.flatMVA(sp)] - q[s, mva])
+                q[s, mva] += update
+                state_sums[s] += update
+                s = sp
+
+            count += 1
+
+
+    def simulateTD(self, *args, **kwargs):
+        returns = super().simulateTD(*args, **kwargs)
+        # the engine updates q directly, so the running sums used by episode() are rebuilt
+        self.state_sums[:] = self.q.sum(axis=1)
+        return returns
+
+
+    # coordinate helpers from before the flat step loop; episode no longer uses them,
+    # they are kept for external callers
 
-    
     def updateActionValues(self, r, c, mva, sp, reward, count):
         # sp is tuple coordinates of the next state
         sp_actions = self.getActions(sp[0], sp[1])
         sp_mva = self.getMVA(sp_actions)
         ret = self.gamma**count * self.action_values[sp[0], sp[1], sp_mva]
         self.action_values[r,c,mva] += ret + reward
-
-
-    def simulate(self, T):
-        for e in range(T):
-            self.episode()
-            if e % 100 == 0:
-                print(f"simulation is { (e / T) * 100 }% done ")
-        
-        if self.animate:
-            self.showAnimation()
-        
-        if self.final_image:
-            self.showFinalValues()    
+        # keep the running sums of the flat step loop in step
+        self.state_sums[r*self.action_values.shape[1] + c] += ret + reward
 
 
     def getMVA(self, actions):
         # get the values of available actions at (r,c)
         nearby_state_values = self.estimateStateValues(actions)
-        # array of booleans where the max value(s) become True and everything else is False
-        # this allows ties to be broken randomly as opposed to always choosing the first occurence
-        bool_max = (nearby_state_values == nearby_state_values.max())
 
         # choose most valuable action (break ties randomly)
-        return np.argmax(bool_max * np.random.random(bool_max.shape))
+        return self.tie_breaker.argmax(nearby_state_values)
     
 
 
@@ -1,19 +1,32 @@
+import os
+import sys
+import time
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from mpl_toolkits.axes_grid1.axes_divider import make_axes_locatable
 import numpy as np
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from GreedySelection import TieBreaker
+from TrajectoryRecorder import TrajectoryRecorder
+from AnimationRenderer import AnimationRenderer
+from GridworldTD import GridworldTD
 
-class Gridworld:
-    def __init__(self, grid_size=10, random_start=False, animate=False, final_image=True):
+
+class Gridworld(GridworldTD):
+    def __init__(self, grid_size=10, random_start=False, animate=False, final_image=True, value_stride=1, max_frames=None, max_episode_steps=None):
         self.grid_size = grid_size
         self.random_start = random_start
         self.gamma = 0.99 # discount
         self.animate = animate
         self.final_image = final_image
+        # a greedy agent can oscillate without ever reaching A' or B'; max_episode_steps opts in to cutting
+        # episodes off after that many moves (None: no cap)
+        self.max_episode_steps = max_episode_steps
 
         # [row][column][up,down,left,right]; +2 for grid border
         self.action_values = np.zeros((self.grid_size+2, self.grid_size+2, 4)) 
+        self.tie_breaker = TieBreaker(4)
 
         # when the agent moves to A/B, the next move must be to A'/B' and will reward 10/5
         self.A = (1, 1) # top left of actual grid
@@ -22,24 +35,19 @@ class Gridworld:
         self.Bp = (self.B[0]+2, self.B[1])
 
         if self.animate:
-            # 3D array with form [iteration, row, column] where value is the sum of all the action values (-1 dimension of policy)
-            self.value_grid_iterations = np.sum(np.expand_dims(self.action_values, axis=0), axis=-1)
-            self.agent_path = np.array([1,1]).reshape((1,2))
+            # agent positions every step and a value grid (the sum of all the action values) every value_stride steps
+            # max_frames keeps only the latest steps in a fixed size ring buffer
+            self.recorder = TrajectoryRecorder(self.action_values.shape[:2], value_stride=value_stride, max_steps=max_frames)
 
 
     def animationBuilder(self, r, c):
-        # sum state/action values as "state_value_grid" 
-        state_value_grid = np.sum(self.action_values, axis=-1)
-
-        # add dimension to current state value grid to stack with previous value grids
-        vg_reshaped = np.expand_dims(state_value_grid, axis=0)
-        
-        # stack all value grids) with current value grid
-        self.value_grid_iterations = np.concatenate((self.value_grid_iterations, vg_reshaped))
+        # sum state/action values as "state_value_grid", but only on the steps that keep a snapshot
+        state_value_grid = None
+        if self.recorder.snapshotDue():
+            state_value_grid = np.sum(self.action_values, axis=-1)
 
-        # complete path of agent over simulation; initialized in simulate()
-        agent_location = np.array([r,c]).reshape((1,2))
-        self.agent_path = np.concatenate((self.agent_path, agent_location))
+        # complete path of agent over simulation
+        self.recorder.record(r, c, state_value_grid)
 
     
     def showAnimation(self):
@@ -49,23 +57,45 @@ class Gridworld:
 
         div = make_axes_locatable(ax)
         cax = div.append_axes('right', '5%', '5%')
-        print(self.value_grid_iterations[-1])
+        if self.recorder.snapshots:
+            print(self.recorder.snapshots[-1])
 
-        def animate(frame):
-            r, c = self.agent_path[frame]
-            grid_with_agent = self.value_grid_iterations[frame]
-            grid_with_agent[r,c] = grid_with_agent.max()
+        # one image artist and one colorbar over the value range of the whole run
+        vmin, vmax = self.valueRange()
+        im = ax.matshow(np.zeros(self.action_values.shape[:2]), cmap='coolwarm', vmin=vmin, vmax=vmax)
+        fig.colorbar(im, cax=cax)
 
-            im = ax.matshow(grid_with_agent, cmap='coolwarm')
-            cax.cla()
-            fig.colorbar(im, cax=cax)
+        def animate(frame):
+            im.set_data(frame[0])
             return im,
 
-        ani = FuncAnimation(fig, animate, frames=self.value_grid_iterations.shape[0], interval=10, blit=True)
-        # ani.save("gw3-animation.mp4")
+        ani = FuncAnimation(fig, animate, frames=self.agentFrames, save_count=len(self.recorder), interval=10, blit=True)
         plt.show()
 
 
+    def valueRange(self):
+        # smallest and largest recorded state value, used as a fixed color scale
+        if not self.recorder.snapshots:
+            return 0, 1
+        return min(v.min() for v in self.recorder.snapshots), max(v.max() for v in self.recorder.snapshots)
+
+
+    def agentFrames(self, every=1):
+        # yields (value grid with the agent's cell set to the max value, label) for every recorded step
+        for step, (r, c), values in self.recorder.frames():
+            if step % every == 0:
+                grid_with_agent = values.copy()
+                grid_with_agent[r,c] = grid_with_agent.max()
+                yield grid_with_agent, f"step {step}"
+
+
+    def saveAnimation(self, path, fps=30, every=1):
+        # renders the recorded run to a video (e.g. .mp4) or .gif without a display
+        vmin, vmax = self.valueRange()
+        renderer = AnimationRenderer(self.action_values.shape[:2], cmap='coolwarm', vmin=vmin, vmax=vmax, title="Gridworld")
+        return renderer.save(self.agentFrames(every), path, fps)
+
+
     def showFinalValues(self):
         cell_values = self.action_values[1:-1,1:-1].sum(axis=-1)
         np.set_printoptions(precision=3, suppress=True)
@@ -106,7 +136,12 @@ class Gridworld:
         plt.show()
 
 
-    def episode(self):
+    def episode(self, max_steps=None, deadline=None):
+        '''
+        Runs one episode until A' or B' is reached, max_steps moves have been made, or
+        time.perf_counter() passes deadline (checked every 1024 moves).
+        Returns (number of moves, True if the episode was cut off).
+        '''
         if self.random_start:
             # start in random spot (not on border)
             r, c = np.random.randint(low=1, high=self.grid_size+1, size=2)
@@ -114,7 +149,7 @@ class Gridworld:
             r,c = self.grid_size - 1, self.grid_size // 2
         
         count = -1
-        # explore the board for T steps
+        # explore the board until A' or B' is reached; count is the number of moves so far
         while True:
             count += 1
             reward = 0
@@ -124,10 +159,15 @@ class Gridworld:
 
             if (r,c) == self.Ap:
                 # agent just moved to A' -> end episode
-                break
+                return count, False
             elif (r,c) == self.Bp:
                 # '' ''         B'
-                break
+                return count, False
+            elif count == max_steps:
+                # move budget used up -> cut the episode off
+                return count, True
+            elif deadline is not None and count % 1024 == 0 and time.perf_counter() > deadline:
+                return count, True
 
 
             ### core SARSA loop
@@ -174,26 +214,12 @@ class Gridworld:
         self.action_values[r,c,a] += ret + reward
 
 
-    def simulate(self, T):
-        for e in range(T):
-            self.episode()
-            if e % 100 == 0:
-                print(f"simulation is { (e / T) * 100 }% done ")
-        
-        if self.animate:
-            self.showAnimation()
-        
-        if self.final_image:
-            self.showFinalValues()    
-
-
     def getMVA(self, r, c):
         # get the values of available actions at (r,c)
         # nearby_state_values = self.estimateStateValues(actions)
         # array of booleans where the max value(s) become True and everything else is False
         # this allows ties to be broken randomly as opposed to always choosing the first occurence
-        local_action_values = self.action_values[r,c]
-        return np.random.choice( np.where(local_action_values == np.amax(local_action_values))[0] ) 
+        return self.tie_breaker.argmax(self.action_values[r,c])
 
 
     def outOfBounds(self, sp):
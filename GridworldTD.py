@@ -0,0 +1,99 @@
+'''
+run loop and TabularTD hookup shared by the Gridworld agents in Gridworld/gridworld3.py and
+Gridworld/gridworld_Q-learning.py
+
+GridworldTD is a mixin; the agent class provides action_values (grid_size+2 square, 4 actions),
+grid_size, gamma, A/Ap/B/Bp, random_start, max_episode_steps, tie_breaker, animate, final_image,
+episode(max_steps, deadline), showAnimation() and showFinalValues()
+'''
+import time
+import numpy as np
+
+from GreedySelection import GreedyCache
+from TabularTD import TabularTD
+
+
+class GridworldTD:
+    def simulate(self, T, max_steps=None, max_seconds=None):
+        '''
+        Runs up to T episodes, each capped at max_episode_steps moves if set. max_steps and max_seconds
+        bound the whole run; once either is used up the current episode is cut off and the run stops.
+        Per-episode moves and truncation flags are kept in episode_lengths and episode_truncated.
+        '''
+        deadline = None if max_seconds is None else time.perf_counter() + max_seconds
+        steps_left = max_steps
+        lengths = []
+        truncated = []
+
+        for e in range(T):
+            cap = self.max_episode_steps
+            if steps_left is not None:
+                cap = steps_left if cap is None else min(cap, steps_left)
+
+            steps, cut_off = self.episode(cap, deadline)
+            lengths.append(steps)
+            truncated.append(cut_off)
+            if e % 100 == 0:
+                print(f"simulation is { (e / T) * 100 }% done ")
+
+            if steps_left is not None:
+                steps_left -= steps
+            if steps_left == 0 or (deadline is not None and time.perf_counter() > deadline):
+                print(f"budget used up after {e+1} of {T} episodes")
+                break
+
+        self.episode_lengths = np.array(lengths, dtype=np.int64)
+        self.episode_truncated = np.array(truncated, dtype=bool)
+        print(f"{self.episode_truncated.sum()} of {len(truncated)} episodes were cut off")
+
+        if self.animate:
+            self.showAnimation()
+        
+        if self.final_image:
+            self.showFinalValues()    
+
+
+    def compileTransitions(self):
+        '''
+        Compiles the board for the TabularTD engine; state s is the cell r*(grid_size+2) + c.
+        Returns a TabularTD whose next_state/rewards follow episode(): A/B jump to A'/B' with 10/5
+        whatever the action, moves into the border bounce back with -1, and A'/B' end the episode.
+        '''
+        n = self.action_values.shape[1]
+        states = np.arange(n*n)
+        rows, cols = np.divmod(states, n)
+        border = (rows == 0) | (rows == n-1) | (cols == 0) | (cols == n-1)
+
+        # [up,down,left,right]; border cells are never occupied, so clipping them is harmless
+        next_state = np.clip(np.column_stack((states-n, states+n, states-1, states+1)), 0, n*n-1)
+        rewards = np.where(border[next_state], -1.0, 0.0)
+        next_state = np.where(border[next_state], states[:, np.newaxis], next_state)
+
+        A, Ap = self.A[0]*n + self.A[1], self.Ap[0]*n + self.Ap[1]
+        B, Bp = self.B[0]*n + self.B[1], self.Bp[0]*n + self.Bp[1]
+        next_state[A], rewards[A] = Ap, 10
+        next_state[B], rewards[B] = Bp, 5
+
+        terminal = np.zeros(n*n, dtype=bool)
+        terminal[[Ap, Bp]] = True
+
+        if self.random_start:
+            start = states[~border & ~terminal]
+        else:
+            start = (self.grid_size - 1)*n + self.grid_size // 2
+        return TabularTD(next_state, rewards, terminal, start, gamma=self.gamma)
+
+
+    def simulateTD(self, T, rule='q_learning', alpha=0.1, epsilon=0.1, n=1, compiled=False, seed=None):
+        '''
+        Runs T episodes of a standard TD control rule (see TabularTD) on action_values instead of
+        the update in episode(). Lengths and truncation flags go to episode_lengths and episode_truncated.
+        compiled=True uses the numba kernel (seeded by seed) when numba is installed.
+        '''
+        td = self.compileTransitions()
+        q = self.action_values.reshape(-1, 4)
+        self.episode_lengths, returns, self.episode_truncated = td.run(
+            q, T, compiled=compiled, seed=seed, rule=rule, alpha=alpha, epsilon=epsilon, n=n,
+            greedy=GreedyCache(q, self.tie_breaker), max_steps=self.max_episode_steps)
+        print(f"{self.episode_truncated.sum()} of {T} episodes were cut off")
+        return returns
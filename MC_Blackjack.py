@@ -1,14 +1,22 @@
+import time
+import multiprocessing
 import numpy as np
-from numpy.lib.shape_base import dsplit
+
+from DealerOutcomes import expectedStandRewards
+
+
+# value arrays are indexed [player sum, dealer's visible card, usable ace]
+STATE_SHAPE = (22, 12, 2)
 
 
 class BlackjackGame:
     def __init__(self) -> None:
-        # states 2-21 are considered for state values and returns arrays
-        self.state_values = dict((x, 0) for x in range(2, 22))
+        # state values are a dense array indexed [player sum, dealer's visible card, usable ace]
+        # player sums 2-21 and dealer cards 2-11 are used; the low rows are left at 0
+        self.state_values = np.zeros(STATE_SHAPE)
 
-        # returns are a dict of k=state, value=[total return for state, n_occurences of state]
-        self.returns = dict((x, [0, 0]) for x in range(2, 22))
+        # returns are [total return for state, n_occurences of state] along the last axis
+        self.returns = np.zeros(STATE_SHAPE + (2,))
 
         self.player_policy = {}
         # parameters: player sum (s), dealer's visible card (d), usable ace (a)
@@ -35,7 +43,7 @@ class BlackjackGame:
 
         # players turn
         while True:
-            game_trace.append(sum(player_hand))
+            game_trace.append(self.stateIndex(sum(player_hand), dealer_visible_card, 11 in player_hand))
 
             # returns T|F from policy
             player_hit = self.player_policy[(
@@ -103,30 +111,324 @@ class BlackjackGame:
 
             # there is only one reward per episode with is w/l/d = 1/-1/0 so that is also the return
             ret = game_trace.pop()
+            returns = self.returns.reshape(-1, 2)
+            state_values = self.state_values.reshape(-1)
             for i in range(len(game_trace)//2):
                 s = game_trace[i*2]
                 a = game_trace[i*2+1]
 
-                new_sum = self.returns[s][0] + ret
-                n_visits = self.returns[s][1] + 1
-
-                # update returns dict
-                self.returns[s] = [new_sum, n_visits]
+                # update returns array
+                returns[s] += (ret, 1)
 
                 # update state value
-                self.state_values[s] = new_sum / n_visits
+                state_values[s] = returns[s, 0] / returns[s, 1]
+
+    def stateIndex(self, s, d, a):
+        # flat index of state (player sum, dealer card, usable ace) into the value arrays; works on arrays too
+        return (s * STATE_SHAPE[1] + d) * 2 + a
+
+    def policyArray(self):
+        # player_policy as a bool array indexed [player sum, dealer card, usable ace]
+        # sums above 21 are never looked up by a live hand and default to stick
+        policy = np.zeros((32, 12, 2), dtype=bool)
+        for (s, d, a), hit in self.player_policy.items():
+            policy[s, d, int(a)] = hit
+        return policy
+
+    def playGames(self, n, rng=None, block=4, policy=None, starts=None, exact_dealer=False):
+        '''
+        Plays n hands at once with the same rules as playGame.
+        Cards are pre-drawn in (n, block) blocks that grow when a long hand runs out,
+        and each hit/stick round only touches the hands still in that phase.
+
+        policy is a bool hit array like policyArray(), or a float array of hit probabilities
+        for a stochastic policy; defaults to player_policy.
+        starts = (player sum, usable ace, dealer card, first action) arrays
+        replaces the dealt state and forces the first action (exploring starts).
+        exact_dealer=True skips the dealer's turn and scores each stick with its expected
+        reward from the precomputed dealer outcome table instead (same mean, lower variance).
+
+        Returns flat arrays with one entry per player decision:
+            (episode, player sum, dealer card, usable ace, hit, step)
+        and the reward of each of the n episodes.
+        '''
+        rng = np.random.default_rng() if rng is None else rng
+        policy = self.policyArray() if policy is None else policy
+
+        player_cards = rng.integers(2, 12, size=(n, block+2))
+        dealer_cards = rng.integers(2, 12, size=(n, block+2))
+
+        # player's starting hand; one starting ace is played as 1, like playGame
+        p_sum = player_cards[:, 0] + player_cards[:, 1]
+        p_aces = (player_cards[:, 0] == 11).astype(np.int64) + (player_cards[:, 1] == 11)
+        has_ace = p_aces > 0
+        p_sum -= 10 * has_ace
+        p_aces -= has_ace
+
+        if starts is not None:
+            p_sum = np.array(starts[0], dtype=np.int64)
+            p_aces = np.array(starts[1], dtype=np.int64)
+            dealer_cards[:, 0] = starts[2]
+
+        dealer_visible_card = dealer_cards[:, 0]
+
+        # players turn
+        visits = []
+        playing = np.arange(n)
+        busted = np.zeros(n, dtype=bool)
+        col = 2
+        step = 0
+        while playing.size > 0:
+            usable = p_aces[playing] > 0
+            hit = policy[p_sum[playing], dealer_visible_card[playing], usable.astype(np.int64)]
+            if policy.dtype != bool:
+                hit = rng.random(playing.size) < hit
+            if step == 0 and starts is not None:
+                hit = np.asarray(starts[3], dtype=bool)
+            visits.append((playing, p_sum[playing], dealer_visible_card[playing], usable, hit, np.full(playing.size, step)))
+
+            playing = playing[hit]
+            if col == player_cards.shape[1]:
+                player_cards = np.hstack((player_cards, rng.integers(2, 12, size=(n, block))))
+            card = player_cards[playing, col]
+            p_sum[playing] += card
+            p_aces[playing] += card == 11
+
+            # over 21: play aces as 1 while there are any (soft 21 + ace needs two), otherwise the player goes bust
+            soft = playing[(p_sum[playing] > 21) & (p_aces[playing] > 0)]
+            while soft.size > 0:
+                p_sum[soft] -= 10
+                p_aces[soft] -= 1
+                soft = soft[(p_sum[soft] > 21) & (p_aces[soft] > 0)]
+            bust = p_sum[playing] > 21
+            busted[playing[bust]] = True
+            playing = playing[~bust]
+
+            col += 1
+            step += 1
+
+        if exact_dealer:
+            rewards = expectedStandRewards()[p_sum, dealer_visible_card]
+            rewards[busted] = -1
+            episode, p_sums, dealer, usable, hit, steps = (np.concatenate(x) for x in zip(*visits))
+            return (episode, p_sums, dealer, usable, hit, steps), rewards
+
+        # dealer's turn; only hands where the player stuck
+        d_sum = dealer_cards[:, 0] + dealer_cards[:, 1]
+        d_aces = (dealer_cards[:, 0] == 11).astype(np.int64) + (dealer_cards[:, 1] == 11)
+        dealing = np.flatnonzero(~busted)
+        col = 2
+        while dealing.size > 0:
+            dealer_hit = dealing[d_sum[dealing] < 17]
+            if col == dealer_cards.shape[1]:
+                dealer_cards = np.hstack((dealer_cards, rng.integers(2, 12, size=(n, block))))
+            card = dealer_cards[dealer_hit, col]
+            d_sum[dealer_hit] += card
+            d_aces[dealer_hit] += card == 11
+
+            # like playGame, the dealer plays any remaining ace as 1 once it reaches 17
+            standing = dealing[d_sum[dealing] >= 17]
+            soft = standing[d_aces[standing] > 0]
+            d_sum[soft] -= 10
+            d_aces[soft] -= 1
+
+            dealing = dealing[(d_sum[dealing] < 17) | (d_aces[dealing] > 0)]
+            col += 1
+
+        # decide games
+        rewards = np.sign(p_sum - d_sum)
+        rewards[d_sum > 21] = 1
+        rewards[busted] = -1
+
+        episode, p_sums, dealer, usable, hit, steps = (np.concatenate(x) for x in zip(*visits))
+        return (episode, p_sums, dealer, usable, hit, steps), rewards
+
+    def simulateBatched(self, n_episodes, batch_size=10**6, seed=None, exact_dealer=False):
+        # plays n_episodes in batches of playGames and feeds them into the returns
+        rng = np.random.default_rng(seed)
+        count = 0
+        start = time.perf_counter()
+        while count < n_episodes:
+            n = min(batch_size, n_episodes - count)
+            (episode, p_sums, dealer, usable, _, _), rewards = self.playGames(n, rng, exact_dealer=exact_dealer)
+
+            # every visit to s adds that episode's single w/l/d reward to the returns of s
+            states = self.stateIndex(p_sums, dealer, usable)
+            ret_sum = np.bincount(states, weights=rewards[episode], minlength=self.state_values.size)
+            n_visits = np.bincount(states, minlength=self.state_values.size)
+            self.mergeReturns(ret_sum, n_visits)
+
+            count += n
+            self.prettyPrintValues(count)
+            print(f"{round(count / (time.perf_counter() - start))} episodes/s")
+            print()
+
+    def controlES(self, n_episodes, batch_size=10**5, seed=None):
+        '''
+        Monte Carlo control with exploring starts over a dense Q[sum, dealer card, usable ace, action]
+        where action 0 is stick and 1 is hit. Episodes are played in batches of playGames,
+        each batch starting from random states and first actions, and the policy is made
+        greedy in place after every batch. Returns the learned hit/stick policy array.
+        '''
+        rng = np.random.default_rng(seed)
+        policy = self.policyArray()
+        q_returns = np.zeros(np.prod(STATE_SHAPE) * 2)
+        q_visits = np.zeros(np.prod(STATE_SHAPE) * 2, dtype=np.int64)
+        self.action_values = np.zeros(STATE_SHAPE + (2,))
+
+        count = 0
+        start = time.perf_counter()
+        while count < n_episodes:
+            n = min(batch_size, n_episodes - count)
+
+            # exploring starts: every (state, action) pair with sum 12-21 can begin an episode
+            starts = (
+                rng.integers(12, 22, size=n), rng.integers(0, 2, size=n),
+                rng.integers(2, 12, size=n), rng.integers(0, 2, size=n))
+            (episode, p_sums, dealer, usable, hit, _), rewards = self.playGames(n, rng, policy=policy, starts=starts)
+
+            pairs = self.stateIndex(p_sums, dealer, usable) * 2 + hit
+            q_returns += np.bincount(pairs, weights=rewards[episode], minlength=q_returns.size)
+            q_visits += np.bincount(pairs, minlength=q_visits.size)
+            visited = q_visits > 0
+            self.action_values.reshape(-1)[visited] = q_returns[visited] / q_visits[visited]
+
+            # greedy improvement in place over the sums exploring starts cover (12-21); sticking wins ties
+            # lower sums are never visited, so they keep hitting
+            policy[12:22] = np.argmax(self.action_values[12:22], axis=-1).astype(bool)
+
+            count += n
+
+        elapsed = time.perf_counter() - start
+        print(f"{count} episodes in {round(elapsed, 2)}s ({round(count / elapsed)} episodes/s)")
+
+        for (s, d, a) in self.player_policy:
+            self.player_policy[(s, d, a)] = bool(policy[s, d, int(a)])
+        return policy
+
+    def evaluateOffPolicy(self, targets, n_episodes, behaviour=None, batch_size=10**5, seed=None):
+        '''
+        Weighted importance sampling evaluation of K target policies from a single stream of
+        behaviour policy episodes. targets is a (K, 32, 12, 2) array of hit probabilities
+        (bool policyArray()s work too); behaviour defaults to hitting with probability 0.5
+        and must hit/stick with nonzero probability wherever a target might.
+
+        C and V are incremental accumulators with the same shape as the value arrays per target:
+            C(s) += W,  V(s) += W / C(s) * (G - V(s))
+        applied a whole batch at a time, which gives the same weighted average.
+        Returns V and C with shape (K,) + STATE_SHAPE.
+        '''
+        rng = np.random.default_rng(seed)
+        targets = np.asarray(targets, dtype=float)
+        behaviour = np.full(targets.shape[1:], 0.5) if behaviour is None else np.asarray(behaviour, dtype=float)
+        K = targets.shape[0]
+        n_states = np.prod(STATE_SHAPE)
+        C = np.zeros(K * n_states)
+        V = np.zeros(K * n_states)
+
+        count = 0
+        while count < n_episodes:
+            n = min(batch_size, n_episodes - count)
+            (episode, p_sums, dealer, usable, hit, steps), rewards = self.playGames(n, rng, policy=behaviour)
+            usable = usable.astype(np.int64)
+
+            # pi(a|s) / b(a|s) for every visit under every target; shape (K, n_visits)
+            pi = targets[:, p_sums, dealer, usable]
+            b = behaviour[p_sums, dealer, usable]
+            ratio = np.where(hit, pi, 1 - pi) / np.where(hit, b, 1 - b)
+
+            # W for the visit at step t is the product of the ratios from t to the end of its episode
+            ratios = np.ones((K, n, steps.max()+1))
+            ratios[:, episode, steps] = ratio
+            W = np.flip(np.cumprod(np.flip(ratios, axis=-1), axis=-1), axis=-1)[:, episode, steps]
+
+            # the return of every visit is the episode's single reward
+            index = (np.arange(K)[:, None] * n_states + self.stateIndex(p_sums, dealer, usable)).reshape(-1)
+            sum_w = np.bincount(index, weights=W.reshape(-1), minlength=C.size)
+            sum_wg = np.bincount(index, weights=(W * rewards[episode]).reshape(-1), minlength=C.size)
+
+            C += sum_w
+            updated = sum_w > 0
+            V[updated] += (sum_wg[updated] - V[updated] * sum_w[updated]) / C[updated]
+
+            count += n
+
+        return V.reshape((K,) + STATE_SHAPE), C.reshape((K,) + STATE_SHAPE)
+
+    def prettyPrintPolicy(self, policy):
+        # H/S grid for player sums 12-21 against the dealer's card, as in the book
+        for ace in [1, 0]:
+            print("usable ace" if ace else "no usable ace")
+            print("\t" + "\t".join(str(d) if d < 11 else "A" for d in range(2, 12)))
+            for k in range(21, 11, -1):
+                print(k, end="\t")
+                print("\t".join("H" if policy[k, d, ace] else "S" for d in range(2, 12)))
+        print()
+
+    def mergeReturns(self, ret_sum, n_visits):
+        # adds flat (sum, count) accumulator arrays indexed by stateIndex into the returns
+        self.returns[..., 0] += ret_sum.reshape(STATE_SHAPE)
+        self.returns[..., 1] += n_visits.reshape(STATE_SHAPE)
+        visited = self.returns[..., 1] > 0
+        self.state_values[visited] = self.returns[..., 0][visited] / self.returns[..., 1][visited]
+
+    def simulateParallel(self, n_episodes, n_workers=None, episodes_per_task=10**6, merge_every=None, seed=0):
+        '''
+        Shards n_episodes across a process pool. Every task gets its own RNG stream
+        spawned from the master seed and returns its own (sum, count) accumulators,
+        which are merged here in task order, so a given seed always gives the same result.
+        '''
+        n_workers = multiprocessing.cpu_count() if n_workers is None else n_workers
+        merge_every = n_workers if merge_every is None else merge_every
+
+        n_tasks = -(-n_episodes // episodes_per_task)
+        streams = np.random.SeedSequence(seed).spawn(n_tasks)
+        tasks = [
+            (self.player_policy, min(episodes_per_task, n_episodes - t*episodes_per_task), stream)
+            for t, stream in enumerate(streams)]
+
+        count = 0
+        start = time.perf_counter()
+        with multiprocessing.Pool(n_workers) as pool:
+            for t, (n, ret_sum, n_visits) in enumerate(pool.imap(simulateShard, tasks), start=1):
+                self.mergeReturns(ret_sum, n_visits)
+                count += n
+                if t % merge_every == 0 or t == n_tasks:
+                    self.prettyPrintValues(count)
+                    print(f"{round(count / (time.perf_counter() - start))} episodes/s on {n_workers} processes")
+                    print()
 
     def prettyPrintValues(self, count):
+        # value surface as in the book: player sums 12-21 against the dealer's card, with and without a usable ace
         print(f"{count}:")
-        for k,v in self.state_values.items():
-            if k == 2:
-                continue
-            print(f"{k} = {round((v+1)/2, 3)}", end="\t")
-            histo = int((v+1) * 20) * "*"
-            print(histo)
+        for ace in [1, 0]:
+            print("usable ace" if ace else "no usable ace")
+            print("\t" + "\t".join(str(d) if d < 11 else "A" for d in range(2, 12)))
+            for k in range(21, 11, -1):
+                print(k, end="\t")
+                print("\t".join(f"{v:.2f}" for v in self.state_values[k, 2:12, ace]))
         print()
 
 
+def simulateShard(task):
+    # worker for BlackjackGame.simulateParallel; plays one shard with its own RNG stream
+    player_policy, n_episodes, stream = task
+    game = BlackjackGame()
+    game.player_policy = player_policy
+    rng = np.random.default_rng(stream)
+
+    ret_sum = np.zeros(np.prod(STATE_SHAPE))
+    n_visits = np.zeros(np.prod(STATE_SHAPE), dtype=np.int64)
+    count = 0
+    while count < n_episodes:
+        n = min(10**6, n_episodes - count)
+        (episode, p_sums, dealer, usable, _, _), rewards = game.playGames(n, rng)
+        states = game.stateIndex(p_sums, dealer, usable)
+        ret_sum += np.bincount(states, weights=rewards[episode], minlength=ret_sum.size)
+        n_visits += np.bincount(states, minlength=n_visits.size)
+        count += n
+    return n_episodes, ret_sum, n_visits
+
 
 if __name__ == "__main__":
     game = BlackjackGame()
@@ -1,12 +1,21 @@
 '''
 hardcoded values match Example 6.5 in the book
+kings_moves / stop_action / stochastic_wind give the variants of Exercises 6.9 and 6.10
 '''
 from matplotlib.animation import FuncAnimation
 import matplotlib.pyplot as plt
 import numpy as np
 
+from GreedySelection import GreedyCache, TieBreaker
+from TrajectoryRecorder import TrajectoryRecorder
+from AnimationRenderer import AnimationRenderer
+from TabularTD import TabularTD
+
 class WindyGridworld:
-    def __init__(self) -> None:
+    # (row, column) offsets; 0-up, 1-right, 2-down, 3-left like a clock, then the diagonals, then no move
+    moves = [(-1,0), (0,1), (1,0), (0,-1), (-1,1), (1,1), (1,-1), (-1,-1), (0,0)]
+
+    def __init__(self, kings_moves=False, stop_action=False, stochastic_wind=False) -> None:
         self.alpha = 0.1
         self.epsilon = 0.1
 
@@ -16,35 +25,46 @@ class WindyGridworld:
         # set terminal state
         self.terminal_state = (3,7)
 
-        # initialize state-action values; 7x10 grid with 4 actions
-        self.action_values = np.zeros(shape=(7,10,4))
+        # 4 actions, 8 with king's moves and 9 when standing still is allowed too
+        if stop_action and not kings_moves:
+            raise ValueError("stop_action is the 9th king's move and needs kings_moves=True")
+        n_actions = 4
+        if kings_moves:
+            n_actions = 9 if stop_action else 8
+
+        # initialize state-action values; 7x10 grid
+        self.action_values = np.zeros(shape=(7,10,n_actions))
 
         # set wind values; applies "upward" to each column
+        # stochastic wind is the mean gust plus -1, 0 or +1 with equal probability in windy columns
         self.wind = np.array([0,0,0,1,1,1,2,2,1,0])
+        self.stochastic_wind = stochastic_wind
+
+        # agent positions of the animated episodes
+        self.recorder = TrajectoryRecorder((7,10))
 
-        self.frames = np.ones(shape=(1,7,10))
+        self.compile()
+
+        # greedy actions are cached per state and only recomputed after that state's values change
+        self.tie_breaker = TieBreaker(n_actions)
+        self.greedy = GreedyCache(self.action_values.reshape(-1, n_actions), self.tie_breaker)
+
+        # the shared TD engine runs the episodes over the compiled arrays; undiscounted
+        n_cols = self.action_values.shape[1]
+        self.td = TabularTD(self.next_state, self.rewards, self.terminal, self.start[0]*n_cols + self.start[1])
 
     
     def randomArgMax(self, arr):
         # returns the index of the highest value with ties broken randomly
-        # _maxs is a boolean array where True values are occurrences of the max value
-        max_as_bool = arr == arr.max()
-        max_indices = np.flatnonzero(max_as_bool)
-        return np.random.choice(max_indices)
+        return self.tie_breaker.argmax(arr)
 
     
     def takeAction(self, agent_pos, agent_action):
         # the action values are ordered such that 0-up, 1-right, 2-down, 3-left; like a clock
         r, c = agent_pos
-
-        if agent_action == 0:
-            r -= 1
-        elif agent_action == 1:
-            c += 1
-        elif agent_action == 2:
-            r += 1
-        elif agent_action == 3:
-            c -= 1
+        dr, dc = self.moves[agent_action]
+        r += dr
+        c += dc
         
         # check whether agent tried to leave grid
         if r in [-1, self.action_values.shape[0]]:
@@ -58,72 +78,140 @@ class WindyGridworld:
             return r,c
 
     
-    def episode(self):
-        # defines the steps that the agent takes from the starting point to the terminal state
-        # set agent to start state
-        agent_pos = self.start
-        agent_path = [agent_pos]
-
-        # choose a from s based on eps-greedy policy (max of action values for state s)
-        if np.random.random() < self.epsilon:
-            agent_action = np.random.randint(4)
+    def compile(self):
+        '''
+        Compiles the environment once into flat arrays that the episode loops index directly:
+            next_state[s, a, k]  flat state reached from flat state s with action a under wind outcome k
+            rewards[s, a, k]     reward of that move
+            terminal[s]          True for the goal
+        the K wind outcomes are equally likely; K = 1 for the deterministic wind
+        '''
+        n_rows, n_cols, n_actions = self.action_values.shape
+        gusts = [-1, 0, 1] if self.stochastic_wind else [0]
+
+        self.next_state = np.empty((n_rows*n_cols, n_actions, len(gusts)), dtype=np.int64)
+        for r in range(n_rows):
+            for c in range(n_cols):
+                for a in range(n_actions):
+                    for k, extra in enumerate(gusts):
+                        # only windy columns vary
+                        gust = self.wind[c] + extra if self.wind[c] > 0 else 0
+
+                        # move up as many times as the gust is strong, then take action a
+                        next_agent_pos = (r,c)
+                        for _ in range(gust):
+                            next_agent_pos = self.takeAction(next_agent_pos, 0)
+                        next_agent_pos = self.takeAction(next_agent_pos, a)
+                        self.next_state[r*n_cols + c, a, k] = next_agent_pos[0]*n_cols + next_agent_pos[1]
+
+        self.terminal = np.zeros(n_rows*n_cols, dtype=bool)
+        self.terminal[self.terminal_state[0]*n_cols + self.terminal_state[1]] = True
+
+        # reward = -1 for all non-terminal moves
+        self.rewards = np.where(self.terminal[self.next_state], 0, -1)
+
+
+    def episode(self, rule='q_learning', n=1, lam=None):
+        '''
+        Runs one eps-greedy episode from the start to the terminal state on the TabularTD engine.
+        The default rule updates q(s,a) towards the greedy action in s' (off-policy, i.e. Q-learning)
+        while moves still follow the eps-greedy policy; rule and n select the other engine updates,
+        e.g. rule='sarsa', n=4 for n-step SARSA. lam switches to SARSA(lambda) with sparse traces.
+        Returns the agent's path on this episode as (row, column) positions.
+        '''
+        n_cols = self.action_values.shape[1]
+        q = self.action_values.reshape(-1, self.action_values.shape[2])
+        agent_path = []
+        if lam is None:
+            self.td.episode(q, rule, self.alpha, self.epsilon, n, greedy=self.greedy, path=agent_path)
         else:
-            agent_action = self.randomArgMax(self.action_values[agent_pos])
-
-        while True:
-            # loop until agent finds terminal state
-            if agent_pos == self.terminal_state:
-                break
-            
-            # apply wind in agent's column
-            gust = self.wind[agent_pos[1]]
-
-            # init s'
-            next_agent_pos = agent_pos
-            for _ in range(gust):
-                # move up as many times as the gust is strong
-                next_agent_pos = self.takeAction(next_agent_pos, 0)
-
-            # take action a with application of wind
-            next_agent_pos = self.takeAction(next_agent_pos, agent_action)
-
-            # store reward = -1 for all non-terminal moves
-            if next_agent_pos == self.terminal_state:
-                reward = 0
-            else:
-                reward = -1
-
-            # choose a' from s' using greedy
-            next_agent_action = self.randomArgMax(self.action_values[next_agent_pos])
-            
-            # q(s', a')
-            q_sp_ap = self.action_values[next_agent_pos][next_agent_action]
-            # q(s, a)
-            q_s_a = self.action_values[agent_pos][agent_action]
-            # update q(s,a) += alpha (reward + q(s',a') - q(s,a)); undiscounted, off-policy SARSA
-            self.action_values[agent_pos][agent_action] += self.alpha * (reward + q_sp_ap - q_s_a)
-
-            # s = s'
-            agent_pos = next_agent_pos
-            agent_path.append(agent_pos)
-
-            # a = a'
-            # off-policy means we only use the greedy action for our prediction: q(s', a')
-            # instead of follow our eps-greedy policy
-            # but we include epsilon when actually making a move
-            if np.random.random() < self.epsilon:
-                agent_action = np.random.randint(4)
-            else:
-                agent_action = next_agent_action
-        # return the agent's path on this episode
-        return agent_path
+            self.td.episodeLambda(q, lam, self.alpha, self.epsilon, greedy=self.greedy, path=agent_path)
+        return [divmod(pos, n_cols) for pos in agent_path]
 
     
-    def simulate(self, n_episodes):
-        # calls each episode and stores analysis data structures
+    def train(self, n_episodes, rule='q_learning', n=1, compiled=True, seed=None):
+        '''
+        Runs n_episodes episodes on action_values without recording paths. With numba installed
+        the whole run is one call into the compiled TabularTD kernel with its own RNG seeded by seed;
+        otherwise it falls back to the NumPy engine. Returns the episode lengths.
+        '''
+        q = self.action_values.reshape(-1, self.action_values.shape[2])
+        lengths, _, _ = self.td.run(
+            q, n_episodes, compiled=compiled, seed=seed, rule=rule, alpha=self.alpha, epsilon=self.epsilon, n=n,
+            greedy=self.greedy)
+        # the kernel or a seeded run updates q behind the greedy cache's back
+        self.greedy.dirty[:] = True
+        return lengths
+
+
+    def simulateBatched(self, n_episodes, alphas=None, epsilons=None, seed=None):
+        '''
+        Runs K independent agents side by side until each has finished n_episodes,
+        with the same update and compiled transitions as episode(). alphas and epsilons are broadcast to K values,
+        so a hyperparameter sweep runs as one batch; each agent only touches its own Q slice.
+        Returns the agents' action values, shape (K,7,10,4), and their episode lengths, shape (K, n_episodes).
+        '''
+        rng = np.random.default_rng(seed)
+        alphas, epsilons = np.broadcast_arrays(
+            np.atleast_1d(self.alpha if alphas is None else alphas),
+            np.atleast_1d(self.epsilon if epsilons is None else epsilons))
+        K = alphas.size
+
+        n_cols = self.action_values.shape[1]
+        n_states, n_actions, n_outcomes = self.next_state.shape
+        start = self.start[0]*n_cols + self.start[1]
+
+        Q = np.zeros((K, n_states, n_actions))
+        lengths = np.zeros((K, n_episodes), dtype=np.int64)
+        episodes = np.zeros(K, dtype=np.int64)
+        steps = np.zeros(K, dtype=np.int64)
+
+        tie_breaker = TieBreaker(n_actions, rng=rng)
+
+        def greedy(agents, states):
+            # argmax of each agent's row with ties broken randomly
+            return tie_breaker.argmaxRows(Q[agents, states])
+
+        def epsGreedy(agents, states, greedy_actions):
+            explore = rng.random(agents.size) < epsilons[agents]
+            return np.where(explore, rng.integers(n_actions, size=agents.size), greedy_actions)
+
+        agents = np.arange(K)
+        s = np.full(K, start)
+        a = epsGreedy(agents, s, greedy(agents, s))
+        while agents.size > 0:
+            k = rng.integers(n_outcomes, size=agents.size)
+            sp = self.next_state[s, a, k]
+            r = self.rewards[s, a, k]
+
+            # off-policy update towards the greedy action in s'
+            ap = greedy(agents, sp)
+            Q[agents, s, a] += alphas[agents] * (r + Q[agents, sp, ap] - Q[agents, s, a])
+            steps[agents] += 1
+
+            s = sp
+            a = epsGreedy(agents, s, ap)
+
+            # agents that reached the goal log the episode and restart
+            done = self.terminal[s]
+            lengths[agents[done], episodes[agents[done]]] = steps[agents[done]]
+            episodes[agents[done]] += 1
+            steps[agents[done]] = 0
+            s[done] = start
+            a[done] = epsGreedy(agents[done], s[done], greedy(agents[done], s[done]))
+
+            # drop agents that have finished all their episodes
+            running = episodes[agents] < n_episodes
+            agents, s, a = agents[running], s[running], a[running]
+
+        return Q.reshape((K,) + self.action_values.shape), lengths
+
+
+    def simulate(self, n_episodes, rule='q_learning', n=1, lam=None):
+        # calls each episode and stores analysis data structures; see episode for rule, n and lam
         avg_steps = 0
         for e in range(n_episodes):
-            agent_path = self.episode()
+            agent_path = self.episode(rule, n, lam)
             print(len(agent_path))
 
             # if e % 1000 == 0:
@@ -150,32 +238,50 @@ class WindyGridworld:
                     a = "v"
                 elif a == 3:
                     a = "<"
+                else:
+                    # king's moves and standing still
+                    a = ["/", "\\", "/", "\\", "."][a-4]
                 print(a, end=" ")
             print()
         print()
 
 
     def animationBuilder(self, agent_path):
-        episode_frames = np.ones(shape=(len(agent_path),7,10))
-        
-        for f, pos in enumerate(agent_path):
-            episode_frames[f][pos] = 0
-
-        self.frames = np.concatenate((self.frames, episode_frames), axis=0)
+        # frames are rebuilt from the recorded positions when the animation is drawn
+        self.recorder.recordPath(agent_path)
 
 
     def showAnimation(self):
         fig = plt.figure("Windy Gridworld",figsize=(20,14))
         ax = fig.add_subplot(111)
 
+        # one image artist, updated in place every frame
+        im = ax.matshow(np.ones(shape=(7,10)), cmap='cividis', vmin=0, vmax=1)
+
         def animate(frame): 
-            im = ax.matshow(self.frames[frame], cmap='cividis')
+            im.set_data(frame[0])
             return im,
 
-        ani = FuncAnimation(fig, animate, frames=self.frames.shape[0], interval=5, blit=True)
+        ani = FuncAnimation(fig, animate, frames=self.agentFrames, save_count=len(self.recorder), interval=5, blit=True)
         plt.show()
 
 
+    def agentFrames(self, every=1):
+        # yields (grid, label) for every recorded step; the agent's cell is 0 and every other cell is 1
+        grid = np.ones(shape=(7,10))
+        for step, pos in enumerate(self.recorder.positions()):
+            if step % every == 0:
+                grid[:] = 1
+                grid[tuple(pos)] = 0
+                yield grid, f"step {step}"
+
+
+    def saveAnimation(self, path, fps=30, every=1):
+        # renders the recorded episodes to a video or GIF without a display
+        renderer = AnimationRenderer((7,10), cmap='cividis', colorbar=False, title="Windy Gridworld")
+        return renderer.save(self.agentFrames(every), path, fps)
+
+
 if __name__ == "__main__":
     wgw = WindyGridworld()
     wgw.simulate(10000)
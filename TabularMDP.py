@@ -0,0 +1,249 @@
+import heapq
+import time
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as splinalg
+
+
+class TabularMDP:
+    def __init__(self, P, R, action_mask=None, terminal=None) -> None:
+        '''
+        Compiled finite MDP that any of the DP solvers can sweep.
+
+        P : sparse matrix, shape (n_states*n_actions, n_states)
+            row s*n_actions + a holds p(s'|s,a); stored as CSR
+        R : array, shape (n_states, n_actions)
+            expected reward r(s,a)
+        action_mask : bool array, shape (n_states, n_actions)
+            False for actions that are not available in s; defaults to all True
+        terminal : bool array, shape (n_states,)
+            terminal states always have a value of 0
+        '''
+        self.n_states, self.n_actions = R.shape
+        self.P = sparse.csr_matrix(P)
+        self.R = np.asarray(R, dtype=float)
+
+        if action_mask is None:
+            action_mask = np.ones(R.shape, dtype=bool)
+        self.action_mask = np.asarray(action_mask, dtype=bool)
+
+        if terminal is None:
+            terminal = np.zeros(self.n_states, dtype=bool)
+        self.terminal = np.asarray(terminal, dtype=bool)
+
+
+    @classmethod
+    def fromTransitions(cls, n_states, n_actions, s, a, sp, prob, reward, action_mask=None, terminal=None):
+        '''
+        Builds the MDP from flat arrays of transitions (s, a, s', p(s'|s,a), r(s,a,s')).
+        Repeated (s, a, s') entries are summed.
+        '''
+        s, a, sp = np.asarray(s), np.asarray(a), np.asarray(sp)
+        prob = np.asarray(prob, dtype=float)
+        rows = s * n_actions + a
+
+        P = sparse.coo_matrix((prob, (rows, sp)), shape=(n_states*n_actions, n_states)).tocsr()
+        R = np.bincount(rows, weights=prob*np.asarray(reward, dtype=float), minlength=n_states*n_actions)
+        return cls(P, R.reshape(n_states, n_actions), action_mask, terminal)
+
+
+    def actionValues(self, v, gamma):
+        # q(s,a) = r(s,a) + gamma * sum_s' p(s'|s,a) v(s'); one sparse matrix-vector product
+        return self.R + gamma * (self.P @ v).reshape(self.n_states, self.n_actions)
+
+
+    def backup(self, v, gamma, policy=None):
+        '''
+        One synchronous Bellman backup of the flat value array v.
+        policy is an (n_states, n_actions) array of action probabilities;
+        when it is None the optimality (max) backup is used instead.
+        '''
+        q = self.actionValues(v, gamma)
+        if policy is None:
+            new_v = np.max(np.where(self.action_mask, q, -np.inf), axis=1)
+        else:
+            new_v = np.sum(policy * q, axis=1)
+        new_v[self.terminal] = 0
+        return new_v
+
+
+    def stateBackup(self, s, v, gamma, policy=None):
+        # backup of a single state, reading only the CSR rows of its actions
+        if self.terminal[s]:
+            return 0.0
+        A = self.n_actions
+        lo, hi = self.P.indptr[s*A], self.P.indptr[(s+1)*A]
+        row = np.repeat(np.arange(A), np.diff(self.P.indptr[s*A:(s+1)*A+1]))
+        q = self.R[s] + gamma * np.bincount(row, self.P.data[lo:hi] * v[self.P.indices[lo:hi]], minlength=A)
+        if policy is None:
+            return np.max(q[self.action_mask[s]])
+        return np.dot(policy[s], q)
+
+
+    def predecessors(self):
+        # CSR (n_states, n_states) pattern whose row s' lists every s with p(s'|s,a) > 0 for some a
+        P_T = self.P.T.tocoo()
+        pred = sparse.coo_matrix(
+            (np.ones(P_T.nnz), (P_T.row, P_T.col // self.n_actions)),
+            shape=(self.n_states, self.n_states)).tocsr()
+        pred.sum_duplicates()
+        return pred
+
+
+    def prioritizedSweep(self, gamma, theta, policy=None, v=None, max_backups=10**8):
+        '''
+        Prioritized sweeping: keeps a max-heap of states keyed by their Bellman error
+        and only backs up a state when it is on top of the heap. After a backup,
+        only the predecessors of the changed state are re-checked and pushed.
+        Stops when no state has a Bellman error above theta.
+        Returns the values and the number of state backups.
+        '''
+        v = np.zeros(self.n_states) if v is None else np.array(v, dtype=float)
+        pred = self.predecessors()
+
+        # seed the heap with every state that is not yet consistent
+        errors = np.abs(self.backup(v, gamma, policy) - v)
+        queued = np.where(errors > theta, errors, 0)
+        heap = [(-e, s) for s, e in enumerate(queued) if e > 0]
+        heapq.heapify(heap)
+
+        backups = 0
+        while heap and backups < max_backups:
+            _, s = heapq.heappop(heap)
+            queued[s] = 0
+
+            # entries can be stale, so recompute before backing up
+            new_v = self.stateBackup(s, v, gamma, policy)
+            if abs(new_v - v[s]) <= theta:
+                continue
+            v[s] = new_v
+            backups += 1
+
+            for p in pred.indices[pred.indptr[s]:pred.indptr[s+1]]:
+                error = abs(self.stateBackup(p, v, gamma, policy) - v[p])
+                # only push when p is not already queued with at least this priority
+                if error > theta and error > queued[p]:
+                    queued[p] = error
+                    heapq.heappush(heap, (-error, p))
+
+        return v, backups
+
+
+    def uniformPolicy(self):
+        # equiprobable random policy over the available actions of each state
+        n_valid = np.maximum(self.action_mask.sum(axis=1, keepdims=True), 1)
+        return self.action_mask / n_valid
+
+
+    def greedyPolicy(self, v, gamma):
+        # index of the most valuable available action in each state (first one on ties)
+        q = self.actionValues(v, gamma)
+        return np.argmax(np.where(self.action_mask, q, -np.inf), axis=1)
+
+
+    def policyMatrix(self, actions):
+        # one-hot (n_states, n_actions) probabilities for a deterministic policy of action indices
+        policy = np.zeros((self.n_states, self.n_actions))
+        policy[np.arange(self.n_states), actions] = 1
+        return policy * self.action_mask
+
+
+    def evaluatePolicy(self, policy, gamma, theta, v=None, max_sweeps=10**6):
+        '''
+        Iterative policy evaluation with synchronous sweeps.
+        Stops once the sup-norm of the change over a whole sweep, max_s |v'(s) - v(s)|, is below theta.
+        Returns the values and the number of sweeps.
+        '''
+        v = np.zeros(self.n_states) if v is None else np.array(v, dtype=float)
+        for sweep in range(1, max_sweeps+1):
+            new_v = self.backup(v, gamma, policy)
+            delta = np.max(np.abs(new_v - v))
+            v = new_v
+            if delta < theta:
+                break
+        return v, sweep
+
+
+    def policySystem(self, policy, gamma):
+        '''
+        Assembles the linear system (I - gamma P_pi) v = r_pi for a fixed policy.
+        Terminal rows are left as the identity so their value solves to 0.
+        '''
+        S, A = self.n_states, self.n_actions
+        weights = np.where(self.terminal[:, None], 0, policy)
+        # W[s, s*A+a] = pi(a|s), so W @ P averages the action rows of P under the policy
+        W = sparse.csr_matrix((weights.reshape(-1), (np.repeat(np.arange(S), A), np.arange(S*A))), shape=(S, S*A))
+        P_pi = W @ self.P
+        r_pi = np.sum(weights * self.R, axis=1)
+        return (sparse.identity(S, format='csr') - gamma * P_pi).tocsc(), r_pi
+
+
+    def solvePolicy(self, policy, gamma, method='auto', theta=1e-8, tol=1e-10, max_direct_states=250000, max_krylov_states=2000000):
+        '''
+        Exact policy evaluation by solving the linear system instead of sweeping.
+        method is 'direct' (sparse LU), 'gmres', 'bicgstab', 'sweep' or 'auto';
+        'auto' picks direct, then gmres, then falls back to sweeps as the state count grows.
+        tol is the relative residual the Krylov solvers stop at; theta is only the stopping
+        threshold of the sweeps ('sweep' and the fallback of a Krylov solve that did not converge).
+        Returns the values, the method used, the time taken and the residual max|(I - gamma P_pi) v - r_pi|.
+        '''
+        if method == 'auto':
+            if self.n_states <= max_direct_states:
+                method = 'direct'
+            elif self.n_states <= max_krylov_states:
+                method = 'gmres'
+            else:
+                method = 'sweep'
+
+        start = time.perf_counter()
+        A, b = self.policySystem(policy, gamma)
+        if method == 'direct':
+            v = splinalg.spsolve(A, b)
+        elif method in ('gmres', 'bicgstab'):
+            solver = splinalg.gmres if method == 'gmres' else splinalg.bicgstab
+            v, info = solver(A, b, rtol=tol, atol=0)
+            if info != 0:
+                # did not converge; finish the job with sweeps from the Krylov estimate
+                v, _ = self.evaluatePolicy(policy, gamma, theta, v)
+        elif method == 'sweep':
+            v, _ = self.evaluatePolicy(policy, gamma, theta)
+        else:
+            raise ValueError(f"unknown method '{method}'")
+        elapsed = time.perf_counter() - start
+
+        residual = np.max(np.abs(A @ v - b))
+        return v, method, elapsed, residual
+
+
+    def valueIteration(self, gamma, theta, v=None, max_sweeps=10**6):
+        # returns the optimal values, the greedy policy and the number of sweeps
+        v, sweeps = self.evaluatePolicy(None, gamma, theta, v, max_sweeps)
+        return v, self.greedyPolicy(v, gamma), sweeps
+
+
+    def policyIteration(self, gamma, theta, v=None, max_sweeps=10**6):
+        '''
+        Alternates evaluation and greedy improvement, starting from the equiprobable random policy.
+        Returns the values, the greedy policy, the total number of evaluation sweeps and of improvements.
+        '''
+        policy = self.uniformPolicy()
+        actions = None
+        total_sweeps = 0
+        improvements = 0
+        while True:
+            v, sweeps = self.evaluatePolicy(policy, gamma, theta, v, max_sweeps)
+            total_sweeps += sweeps
+
+            q = np.where(self.action_mask, self.actionValues(v, gamma), -np.inf)
+            greedy = np.argmax(q, axis=1)
+            # stable when the old action is still (within theta) as good as the best one
+            # comparing values rather than indices stops ties from flipping the policy forever
+            if actions is not None:
+                live = ~self.terminal
+                old_q = q[np.arange(self.n_states), actions]
+                if np.all(old_q[live] >= q.max(axis=1)[live] - theta):
+                    return v, actions, total_sweeps, improvements
+
+            actions = greedy
+            policy = self.policyMatrix(actions)
+            improvements += 1
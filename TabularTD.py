@@ -0,0 +1,358 @@
+import numpy as np
+
+from GreedySelection import GreedyCache, TieBreaker
+
+# optional compiled backend for the sequential episode loop
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+HAVE_NUMBA = njit is not None
+
+
+def jit(f):
+    # nopython-compiles f when numba is installed; otherwise f stays a plain python function
+    return njit(cache=True)(f) if HAVE_NUMBA else f
+
+
+class TabularTD:
+    # bootstrap value of (s', a') in the update target
+    rules = ('sarsa', 'q_learning', 'expected_sarsa')
+
+    def __init__(self, next_state, rewards, terminal, start, gamma=1.0, rng=None) -> None:
+        '''
+        Tabular TD control over an environment compiled to integer arrays.
+
+        next_state : int array, shape (n_states, n_actions, K)
+            flat state reached from s with action a under outcome k; the K outcomes are equally likely
+            (a 2-D array is a deterministic environment with K = 1)
+        rewards : array, same shape as next_state
+            reward of that transition
+        terminal : bool array, shape (n_states,)
+            episodes end on reaching a terminal state
+        start : int or int array
+            start state, or start states drawn uniformly at the beginning of each episode
+        '''
+        self.next_state = np.asarray(next_state)
+        self.rewards = np.asarray(rewards, dtype=float)
+        if self.next_state.ndim == 2:
+            self.next_state = self.next_state[..., np.newaxis]
+            self.rewards = self.rewards[..., np.newaxis]
+        self.n_states, self.n_actions, self.n_outcomes = self.next_state.shape
+
+        self.terminal = np.asarray(terminal, dtype=bool)
+        self.start = np.atleast_1d(start)
+        self.gamma = gamma
+        self.rng = np.random.default_rng() if rng is None else rng
+
+
+    def episode(self, q, rule='sarsa', alpha=0.1, epsilon=0.1, n=1, greedy=None, max_steps=None, path=None, rng=None):
+        '''
+        Runs one eps-greedy episode of n-step TD control, updating the (n_states, n_actions) array q in place.
+        rule picks the bootstrap value: q(s',a') for sarsa, max q(s') for q_learning and
+        the eps-greedy expectation of q(s') for expected_sarsa; n=1 gives the one-step methods.
+        greedy is a GreedyCache over q to reuse across episodes; it is invalidated on every update.
+        An episode cut off after max_steps bootstraps from the state it stopped in.
+        Visited states are appended to path when it is a list.
+        rng is the Generator for this episode; defaults to the instance rng.
+        Returns (steps, undiscounted return, True if the episode was cut off).
+        '''
+        if rule not in self.rules:
+            raise ValueError(f"unknown rule {rule!r}; expected one of {self.rules}")
+        if greedy is None:
+            greedy = GreedyCache(q)
+
+        rng = self.rng if rng is None else rng
+        next_state, rewards, terminal = self.next_state, self.rewards, self.terminal
+        n_actions, n_outcomes, gamma = self.n_actions, self.n_outcomes, self.gamma
+
+        def act(s):
+            # eps-greedy action in s
+            if epsilon > 0 and rng.random() < epsilon:
+                return int(rng.integers(n_actions))
+            return greedy.action(s)
+
+        def value(s, a):
+            # bootstrap value of (s, a) under the update rule
+            if rule == 'sarsa':
+                return q[s, a]
+            q_max = q[s, greedy.action(s)]
+            if rule == 'q_learning':
+                return q_max
+            return (1 - epsilon) * q_max + epsilon * q[s].mean()
+
+        # circular buffers of the last n+1 states, actions and rewards; index t % (n+1)
+        S = [0] * (n+1)
+        A = [0] * (n+1)
+        R = [0.0] * (n+1)
+
+        s = int(self.start[rng.integers(len(self.start))]) if len(self.start) > 1 else int(self.start[0])
+        S[0], A[0] = s, act(s)
+        if path is not None:
+            path.append(s)
+
+        T = np.inf
+        truncated = False
+        total = 0.0
+        t = 0
+        while True:
+            if t < T:
+                # take A_t in S_t
+                s, a = S[t % (n+1)], A[t % (n+1)]
+                k = int(rng.integers(n_outcomes)) if n_outcomes > 1 else 0
+                sp = int(next_state[s, a, k])
+                r = rewards[s, a, k]
+                total += r
+                S[(t+1) % (n+1)], R[(t+1) % (n+1)] = sp, r
+                if path is not None:
+                    path.append(sp)
+
+                if terminal[sp]:
+                    T = t + 1
+                else:
+                    A[(t+1) % (n+1)] = act(sp)
+                    if max_steps is not None and t + 1 >= max_steps:
+                        T = t + 1
+                        truncated = True
+
+            # time step whose estimate is updated
+            tau = t - n + 1
+            if tau >= 0:
+                end = min(tau + n, T)
+                G = 0.0
+                for i in range(end, tau, -1):
+                    G = R[i % (n+1)] + gamma * G
+                if tau + n < T or truncated:
+                    G += gamma**(end - tau) * value(S[end % (n+1)], A[end % (n+1)])
+
+                s_tau, a_tau = S[tau % (n+1)], A[tau % (n+1)]
+                q[s_tau, a_tau] += alpha * (G - q[s_tau, a_tau])
+                greedy.invalidate(s_tau)
+
+            if tau == T - 1:
+                return int(T), total, truncated
+            t += 1
+
+
+    def episodeLambda(self, q, lam=0.9, alpha=0.1, epsilon=0.1, greedy=None, max_steps=None, path=None, cutoff=1e-4, rng=None):
+        '''
+        Runs one eps-greedy episode of SARSA(lambda) with replacing traces, updating q in place.
+        The traces are a dict of flat (s*n_actions + a) -> trace holding only the active pairs;
+        a trace is dropped once it decays below cutoff, so each step costs O(active pairs)
+        instead of a decay over the whole table. Arguments and return value are as in episode.
+        '''
+        if greedy is None:
+            greedy = GreedyCache(q)
+
+        rng = self.rng if rng is None else rng
+        next_state, rewards, terminal = self.next_state, self.rewards, self.terminal
+        n_actions, n_outcomes, gamma = self.n_actions, self.n_outcomes, self.gamma
+        q_flat = q.reshape(-1)
+        decay = gamma * lam
+
+        def act(s):
+            # eps-greedy action in s
+            if epsilon > 0 and rng.random() < epsilon:
+                return int(rng.integers(n_actions))
+            return greedy.action(s)
+
+        s = int(self.start[rng.integers(len(self.start))]) if len(self.start) > 1 else int(self.start[0])
+        a = act(s)
+        if path is not None:
+            path.append(s)
+
+        traces = {}
+        total = 0.0
+        steps = 0
+        while True:
+            k = int(rng.integers(n_outcomes)) if n_outcomes > 1 else 0
+            sp = int(next_state[s, a, k])
+            r = rewards[s, a, k]
+            total += r
+            steps += 1
+            if path is not None:
+                path.append(sp)
+
+            done = terminal[sp]
+            cut_off = not done and max_steps is not None and steps >= max_steps
+            if done:
+                delta = r - q[s, a]
+            else:
+                ap = act(sp)
+                delta = r + gamma * q[sp, ap] - q[s, a]
+
+            # replacing trace for (s, a), then one sweep over the active pairs
+            traces[s*n_actions + a] = 1.0
+            for i, e in list(traces.items()):
+                q_flat[i] += alpha * delta * e
+                greedy.invalidate(i // n_actions)
+                if e * decay < cutoff:
+                    del traces[i]
+                else:
+                    traces[i] = e * decay
+
+            if done or cut_off:
+                return steps, total, cut_off
+            s, a = sp, ap
+
+
+    def run(self, q, n_episodes, compiled=False, seed=None, **kwargs):
+        '''
+        Runs n_episodes episodes on q with one shared GreedyCache; kwargs are passed to episode.
+        compiled=True runs the whole loop in the numba kernel with its own xorshift RNG seeded by seed
+        (kwargs then only take rule, alpha, epsilon, n and max_steps); without numba it falls back to episode.
+        With a seed the fallback runs on its own default_rng(seed), tie-breaking included, so a passed
+        GreedyCache is replaced; like after the kernel, the caller must invalidate it.
+        Returns the episode lengths, returns and truncation flags as arrays.
+        '''
+        if compiled and HAVE_NUMBA:
+            # the kernel picks greedy actions itself; a passed GreedyCache must be invalidated by the caller
+            kwargs.pop('greedy', None)
+            return self.runKernel(q, n_episodes, seed=seed, **kwargs)
+
+        if seed is not None:
+            rng = np.random.default_rng(seed)
+            kwargs['rng'] = rng
+            kwargs['greedy'] = GreedyCache(q, TieBreaker(q.shape[1], rng=rng))
+        kwargs.setdefault('greedy', GreedyCache(q))
+        lengths = np.zeros(n_episodes, dtype=np.int64)
+        returns = np.zeros(n_episodes)
+        truncated = np.zeros(n_episodes, dtype=bool)
+        for e in range(n_episodes):
+            lengths[e], returns[e], truncated[e] = self.episode(q, **kwargs)
+        return lengths, returns, truncated
+
+
+    def runKernel(self, q, n_episodes, rule='sarsa', alpha=0.1, epsilon=0.1, n=1, max_steps=None, seed=None):
+        # same episodes as run, in the kernel; q must be a C-contiguous float64 array (a view is updated in place)
+        if rule not in self.rules:
+            raise ValueError(f"unknown rule {rule!r}; expected one of {self.rules}")
+        seed = np.random.SeedSequence(seed).generate_state(1, np.uint64)
+        # xorshift state must not be 0
+        rng_state = np.array([seed[0] | np.uint64(1)], dtype=np.uint64)
+
+        lengths = np.zeros(n_episodes, dtype=np.int64)
+        returns = np.zeros(n_episodes)
+        truncated = np.zeros(n_episodes, dtype=bool)
+        runEpisodes(
+            self.next_state, self.rewards, self.terminal, self.start, q, self.rules.index(rule),
+            alpha, epsilon, self.gamma, n, -1 if max_steps is None else max_steps,
+            rng_state, lengths, returns, truncated)
+        return lengths, returns, truncated
+
+
+
+@jit
+def uniform(rng_state):
+    # xorshift64 step of rng_state[0]; returns a float in [0, 1)
+    x = rng_state[0]
+    x ^= x << np.uint64(13)
+    x ^= x >> np.uint64(7)
+    x ^= x << np.uint64(17)
+    rng_state[0] = x
+    return (x >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+@jit
+def greedyAction(q, s, rng_state):
+    # argmax of q[s] with ties broken uniformly (reservoir sampling over the max entries)
+    best = 0
+    n_best = 1
+    for a in range(1, q.shape[1]):
+        if q[s, a] > q[s, best]:
+            best = a
+            n_best = 1
+        elif q[s, a] == q[s, best]:
+            n_best += 1
+            if uniform(rng_state) * n_best < 1:
+                best = a
+    return best
+
+
+@jit
+def epsGreedyAction(q, s, epsilon, rng_state):
+    if epsilon > 0 and uniform(rng_state) < epsilon:
+        return int(uniform(rng_state) * q.shape[1])
+    return greedyAction(q, s, rng_state)
+
+
+@jit
+def bootstrapValue(q, s, a, rule, epsilon):
+    # q(s',a') for sarsa (0), max q(s') for q_learning (1), the eps-greedy expectation for expected_sarsa (2)
+    if rule == 0:
+        return q[s, a]
+    q_max = q[s, 0]
+    q_sum = 0.0
+    for b in range(q.shape[1]):
+        q_max = max(q_max, q[s, b])
+        q_sum += q[s, b]
+    if rule == 1:
+        return q_max
+    return (1 - epsilon) * q_max + epsilon * q_sum / q.shape[1]
+
+
+@jit
+def runEpisodes(next_state, rewards, terminal, start, q, rule, alpha, epsilon, gamma, n, max_steps,
+                rng_state, lengths, returns, truncated):
+    '''
+    Kernel of TabularTD.episode for n_episodes = len(lengths) episodes in a row; max_steps < 0 means no cap.
+    Only scalar loops over the arrays, so it compiles in numba's nopython mode.
+    '''
+    n_outcomes = next_state.shape[2]
+    # circular buffers of the last n+1 states, actions and rewards; index t % (n+1)
+    S = np.zeros(n+1, dtype=np.int64)
+    A = np.zeros(n+1, dtype=np.int64)
+    R = np.zeros(n+1)
+    never = 2**62
+
+    for e in range(lengths.shape[0]):
+        s = start[int(uniform(rng_state) * start.shape[0])] if start.shape[0] > 1 else start[0]
+        S[0] = s
+        A[0] = epsGreedyAction(q, s, epsilon, rng_state)
+
+        T = never
+        cut_off = False
+        total = 0.0
+        t = 0
+        while True:
+            if t < T:
+                # take A_t in S_t
+                s = S[t % (n+1)]
+                a = A[t % (n+1)]
+                k = int(uniform(rng_state) * n_outcomes) if n_outcomes > 1 else 0
+                sp = next_state[s, a, k]
+                r = rewards[s, a, k]
+                total += r
+                S[(t+1) % (n+1)] = sp
+                R[(t+1) % (n+1)] = r
+
+                if terminal[sp]:
+                    T = t + 1
+                else:
+                    A[(t+1) % (n+1)] = epsGreedyAction(q, sp, epsilon, rng_state)
+                    if max_steps >= 0 and t + 1 >= max_steps:
+                        T = t + 1
+                        cut_off = True
+
+            # time step whose estimate is updated
+            tau = t - n + 1
+            if tau >= 0:
+                end = min(tau + n, T)
+                G = 0.0
+                for i in range(end, tau, -1):
+                    G = R[i % (n+1)] + gamma * G
+                if tau + n < T or cut_off:
+                    G += gamma**(end - tau) * bootstrapValue(q, S[end % (n+1)], A[end % (n+1)], rule, epsilon)
+
+                s_tau = S[tau % (n+1)]
+                a_tau = A[tau % (n+1)]
+                q[s_tau, a_tau] += alpha * (G - q[s_tau, a_tau])
+
+            if tau == T - 1:
+                break
+            t += 1
+
+        lengths[e] = T
+        returns[e] = total
+        truncated[e] = cut_off
@@ -0,0 +1,134 @@
+import numpy as np
+
+
+class TrajectoryRecorder:
+    def __init__(self, grid_shape, value_stride=0, chunk_size=4096, max_steps=None, path=None) -> None:
+        '''
+        Records an agent's (row, column) position every step, and optionally a snapshot of a
+        value grid every value_stride steps, for building animations of long runs.
+
+        Positions are int16 and are written into preallocated chunks of chunk_size steps,
+        so recording costs linear time instead of re-concatenating the whole history.
+        max_steps turns the recorder into a ring buffer that keeps only the latest steps in fixed RAM.
+        path appends full chunks of positions to a raw int16 file instead of keeping them in RAM;
+        positions() then reads them back through a memory map.
+        '''
+        self.grid_shape = tuple(grid_shape)
+        self.value_stride = value_stride
+        self.chunk_size = chunk_size
+        self.max_steps = max_steps
+        self.path = path
+
+        # total number of steps recorded so far; with max_steps only the last max_steps are kept
+        self.n_steps = 0
+        # steps already appended to the file at path
+        self.n_written = 0
+
+        self.chunks = []
+        if max_steps is not None:
+            self.ring = np.empty((max_steps, 2), dtype=np.int16)
+        if path is not None:
+            # start a fresh file; chunks are appended to it as they fill up
+            open(path, 'wb').close()
+
+        # value snapshots are taken every value_stride steps; snapshot_steps holds the step of each one
+        self.snapshots = []
+        self.snapshot_steps = []
+
+
+    def snapshotDue(self):
+        # True when the next recorded step will take a value snapshot
+        return bool(self.value_stride) and self.n_steps % self.value_stride == 0
+
+
+    def record(self, r, c, values=None):
+        # store the position for this step; values is only read (and copied) on snapshot steps
+        if values is not None and self.snapshotDue():
+            self.snapshots.append(np.array(values, dtype=np.float32))
+            self.snapshot_steps.append(self.n_steps)
+            if self.max_steps is not None:
+                # drop snapshots that have left the ring, but keep the latest one at or before the
+                # oldest kept step since that step still shows it
+                first = self.n_steps + 1 - self.max_steps
+                while len(self.snapshot_steps) > 1 and self.snapshot_steps[1] <= first:
+                    self.snapshots.pop(0)
+                    self.snapshot_steps.pop(0)
+
+        if self.max_steps is not None:
+            self.ring[self.n_steps % self.max_steps] = (r, c)
+        else:
+            i = self.n_steps % self.chunk_size
+            if i == 0:
+                if self.path is not None and self.chunks:
+                    # the previous chunk is full; move it to the file and reuse its buffer
+                    self.flush()
+                else:
+                    self.chunks.append(np.empty((self.chunk_size, 2), dtype=np.int16))
+            self.chunks[-1][i] = (r, c)
+
+        self.n_steps += 1
+
+
+    def recordPath(self, path, values=None):
+        # record a whole episode of (row, column) positions at once
+        for r, c in path:
+            self.record(r, c, values)
+
+
+    def flush(self):
+        # append the buffered positions to the file; only used with a path
+        if self.n_steps > self.n_written:
+            # the buffer holds the steps from the start of the current chunk
+            chunk_start = (self.n_steps - 1) // self.chunk_size * self.chunk_size
+            with open(self.path, 'ab') as f:
+                f.write(self.chunks[-1][self.n_written - chunk_start:self.n_steps - chunk_start].tobytes())
+            self.n_written = self.n_steps
+
+
+    def positions(self):
+        # (n, 2) int16 array of the kept positions, oldest first
+        if self.max_steps is not None:
+            if self.n_steps <= self.max_steps:
+                return self.ring[:self.n_steps]
+            start = self.n_steps % self.max_steps
+            return np.concatenate((self.ring[start:], self.ring[:start]))
+        if self.path is not None:
+            self.flush()
+            if self.n_steps == 0:
+                return np.empty((0, 2), dtype=np.int16)
+            return np.memmap(self.path, dtype=np.int16, mode='r', shape=(self.n_steps, 2))
+        if not self.chunks:
+            return np.empty((0, 2), dtype=np.int16)
+        return np.concatenate(self.chunks)[:self.n_steps]
+
+
+    def firstStep(self):
+        # step number of the oldest kept position
+        if self.max_steps is None:
+            return 0
+        return max(0, self.n_steps - self.max_steps)
+
+
+    def valuesAt(self, step):
+        # latest value snapshot taken at or before step, or zeros when there is none
+        i = np.searchsorted(self.snapshot_steps, step, side='right') - 1
+        if i < 0:
+            return np.zeros(self.grid_shape, dtype=np.float32)
+        return self.snapshots[i]
+
+
+    def frames(self):
+        # yields (step, (row, column), value grid) for every kept step
+        first = self.firstStep()
+        values = self.valuesAt(first)
+        i_snapshot = np.searchsorted(self.snapshot_steps, first, side='right')
+        for i, pos in enumerate(self.positions()):
+            # advance to the next snapshot once its step is reached
+            if i_snapshot < len(self.snapshot_steps) and self.snapshot_steps[i_snapshot] == first + i:
+                values = self.snapshots[i_snapshot]
+                i_snapshot += 1
+            yield first + i, pos, values
+
+
+    def __len__(self):
+        return min(self.n_steps, self.max_steps) if self.max_steps is not None else self.n_steps
@@ -9,6 +9,7 @@
 
 import random
 import sys
+import multiprocessing
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -21,49 +22,75 @@ class DeckEmptyException(Exception):
 
 
 class Deck:
-    def __init__(self, n=-1) -> None:
+    # one deck's worth of card values; 10/J/Q/K all count as 10 and aces as 11
+    ranks = np.array([2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11])
+
+    def __init__(self, n=-1, penetration=1.0, batch_size=4096) -> None:
         # number of decks used can be passed as argument
         # defaults to infinite deck
         # aces are considered 11 throughout sim until player goes bust
         # losing triggers an action to see if the player can stay in the game by using ace as a 1
 
-        cards = dict()
-        # init deck
-        for c in range(2,12):
-            if n == -1: # psuedoinfinite deck
-                cards[c] = sys.maxsize
-            else:
-                if c == 10:
-                    cards[c] = 16*n
-                else:
-                    cards[c] = 4*n
-        self.cards = cards
+        # the shoe is a pre-shuffled array of cards with a cursor at the next card to deal
+        # infinite decks deal from a precomputed batch of random cards that is refilled when used up
+        # finite shoes are reshuffled between hands once penetration (< 1) of the shoe has been dealt;
+        # the default of 1.0 deals the whole shoe and raises DeckEmptyException once it is empty, like before
+        self.n = n
+        self.penetration = penetration
+        self.batch_size = batch_size
+        self.shoe = np.repeat(self.ranks, 4 * max(n, 1))
+        self.shuffle()
+
+    def shuffle(self):
+        if self.n == -1: # psuedoinfinite deck
+            self.shoe = np.random.choice(self.ranks, size=self.batch_size)
+        else:
+            np.random.shuffle(self.shoe)
+        self.cursor = 0
+
+    def checkPenetration(self):
+        # called between hands; reshuffles a finite shoe that has been dealt past its penetration
+        if self.n != -1 and self.penetration < 1 and self.cursor >= self.penetration * len(self.shoe):
+            self.shuffle()
 
     def getDeck(self):
-        return self.cards
+        # remaining count of each card value
+        remaining = np.bincount(self.shoe[self.cursor:], minlength=12)
+        if self.n == -1:
+            return dict((c, sys.maxsize) for c in range(2,12))
+        return dict((c, int(remaining[c])) for c in range(2,12))
 
     def getCard(self):
-        # since the deck dictionary has keys 1-11
-        # we must map the actual cards in a deck
-        # to this range (otherwise the chance of getting a face card is way too low)
-        if max(self.cards.values()) < 1:
-            raise DeckEmptyException()
-
-        while True:
-            card = random.randint(1,13)
-            if card in [10,11,12,13]:
-                card = 10
-            elif card == 1:
-                card = 11
-
-            if self.cards[card] < 1:
-                continue
-            else:
-                break
-
-        self.cards[card] -= 1
+        # constant time: deal the card under the cursor
+        if self.cursor == len(self.shoe):
+            if self.n != -1:
+                raise DeckEmptyException()
+            self.shuffle()
+
+        card = int(self.shoe[self.cursor])
+        self.cursor += 1
         return card
 
+    def getCards(self, k):
+        # bulk draw of k cards as an array
+        if self.n == -1:
+            cards = []
+            while k > 0:
+                if self.cursor == len(self.shoe):
+                    self.shuffle()
+                take = min(k, len(self.shoe) - self.cursor)
+                cards.append(self.shoe[self.cursor:self.cursor+take])
+                self.cursor += take
+                k -= take
+            return np.concatenate(cards)
+
+        if self.cursor + k > len(self.shoe):
+            raise DeckEmptyException()
+        # a copy, since the next shuffle rewrites the shoe in place
+        cards = self.shoe[self.cursor:self.cursor+k].copy()
+        self.cursor += k
+        return cards
+
     
 
 
@@ -100,6 +127,9 @@ class Dealer:
 
 
 class Player:
+    # hands never go past 31 (20 + 11) or 11 cards (ten 2s and one more)
+    policy_shape = (32, 2, 12)
+
     def __init__(self, dealer: Dealer, learning_rate=0.1) -> None:
         self.dealer = dealer
 
@@ -107,7 +137,9 @@ class Player:
         self.is_hitting = True
 
         self.init_policy = self.initPolicy()
-        self.learned_policy = dict()
+        # confidence of hitting, indexed by the canonical hand key (sum, soft, n_cards)
+        # NaN marks hands that have not been learned yet
+        self.learned_policy = np.full(self.policy_shape, np.nan)
         self.learning_rate = learning_rate
 
 
@@ -116,6 +148,11 @@ class Player:
         self.hand.append(card)
 
 
+    def handKey(self, hand):
+        # canonical key for a hand regardless of card order: (sum, holds an ace as 11, number of cards)
+        return sum(hand), int(11 in hand), len(hand)
+
+
     def stick(self):
         self.is_hitting = False
 
@@ -133,15 +170,15 @@ class Player:
             self.is_hitting = False
             return
 
-        # lookup the state tuple in the policy table
+        # lookup the hand key in the policy table
         # use init_policy if the player has a new hand
-        hashable_hand = tuple(self.hand)
-        if self.learned_policy.__contains__(hashable_hand):
+        confidence = self.learned_policy[self.handKey(self.hand)]
+        if not np.isnan(confidence):
             # learned policy
             # explore when confidence is 50% +/-10%
-            if self.learned_policy[hashable_hand] >= 0.6:
+            if confidence >= 0.6:
                 self.hit()
-            elif self.learned_policy[hashable_hand] < 0.4:
+            elif confidence < 0.4:
                 self.stick()
             else:
                 if np.random.choice([True, False]):
@@ -160,7 +197,7 @@ class Player:
     def updatePolicy(self, win: bool):
         '''After each game, update this policy.
         Iterate backwards across the player's hand as such:
-        - hash hand
+        - look up the hand key
         - raise or lower the confidence of sticking for that hashed state
         - this method should heavily weight reinforcement of later actions
         take into account how far over the player went; going from 12 to 22 should be reinforced more than going from 20 to 30
@@ -173,10 +210,10 @@ class Player:
         '''
 
         while len(self.hand) >= 2: # player is dealt 2 cards at start so learning should not be done on a hand of 1 card
-            hashable_hand = tuple(self.hand)
+            key = self.handKey(self.hand)
             # init policy at 50%
-            if not self.learned_policy.__contains__(hashable_hand):
-                self.learned_policy[hashable_hand] = 0.5
+            if np.isnan(self.learned_policy[key]):
+                self.learned_policy[key] = 0.5
 
             # correction_factor increases the update more for wins
             # and lowers the update more for losses
@@ -189,13 +226,13 @@ class Player:
         
             # win update 
             if win:
-                confidence_correction = 1 - self.learned_policy[hashable_hand]
+                confidence_correction = 1 - self.learned_policy[key]
                 policy_update = self.learning_rate * confidence_correction * distance_factor
-                self.learned_policy[hashable_hand] += policy_update
+                self.learned_policy[key] += policy_update
             else:
-                confidence_correction = 0 - self.learned_policy[hashable_hand]
+                confidence_correction = 0 - self.learned_policy[key]
                 policy_update = self.learning_rate * confidence_correction * distance_factor
-                self.learned_policy[hashable_hand] += policy_update
+                self.learned_policy[key] += policy_update
 
             self.hand.pop()
 
@@ -203,20 +240,27 @@ class Player:
 
             
 class Game:
-    def __init__(self, n_decks=-1) -> None:
+    # largest possible final sums: the player hits below 21 (20 + 11) and the dealer at 30 or less (30 + 11)
+    max_sum = 41
+
+    def __init__(self, n_decks=-1, record_hands=True) -> None:
         self.deck = Deck(n_decks)
         self.dealer = Dealer(self.deck)
         self.player = Player(self.dealer)
 
         # analysis
+        # the per-hand lists grow with every game, so headless runs turn them off and keep only the histograms
+        self.record_hands = record_hands
         self.player_hands = []
         self.dealer_hands = []
+        self.player_sums = np.zeros(self.max_sum+1, dtype=np.int64)
+        self.dealer_sums = np.zeros(self.max_sum+1, dtype=np.int64)
         self.wins = { True: 0, False: 0 }
     
 
-    def simulate(self, n_games: np.uint):
+    def simulate(self, n_games: np.uint, show_plot=True, verbose=True):
         for g in range(n_games):
-            if g % 25 == 0:
+            if verbose and g % 25 == 0:
                 if g == 0:
                     continue
                 win_rate = self.wins[True] / sum(self.wins.values())
@@ -224,6 +268,9 @@ class Game:
             
             self.play()
 
+        if not show_plot:
+            return
+
         # helper plots
         plt.figure(figsize=(30,15))
         plt.plot(self.player_hands, label="player")
@@ -235,6 +282,9 @@ class Game:
     def play(self):
         player_wins = None
 
+        # reshuffle between hands once the shoe is past its penetration
+        self.deck.checkPenetration()
+
         # setup: give dealer and player two cards
         for _ in range(2):
             self.dealer.hit()
@@ -263,8 +313,11 @@ class Game:
             player_wins = False
 
         # analysis
-        self.player_hands.append(player_sum)
-        self.dealer_hands.append(dealer_sum)
+        if self.record_hands:
+            self.player_hands.append(player_sum)
+            self.dealer_hands.append(dealer_sum)
+        self.player_sums[player_sum] += 1
+        self.dealer_sums[dealer_sum] += 1
         self.wins[player_wins] += 1
 
         # update policy
@@ -274,6 +327,41 @@ class Game:
         self.player.hand = []
         self.dealer.hand = []
 
+
+
+def playTable(task):
+    # worker for simulateTables; plays one headless table and returns only its compact statistics
+    n_games, n_decks, seed = task
+    random.seed(int(seed.generate_state(1)[0]))
+    np.random.seed(seed.generate_state(1)[0])
+
+    game = Game(n_decks, record_hands=False)
+    game.simulate(n_games, show_plot=False, verbose=False)
+    return game.wins[True], game.wins[False], game.player_sums, game.dealer_sums
+
+
+def simulateTables(n_tables, n_games, n_decks=-1, n_workers=None, seed=0):
+    '''
+    Plays n_tables independent Games of n_games hands each across a process pool, with no plotting.
+    Every table is seeded from its own stream of the master seed, so results are reproducible.
+    Returns total wins, total losses and the player / dealer final sum histograms over all tables.
+    '''
+    n_workers = multiprocessing.cpu_count() if n_workers is None else n_workers
+    tasks = [(n_games, n_decks, s) for s in np.random.SeedSequence(seed).spawn(n_tables)]
+
+    wins, losses = 0, 0
+    player_sums = np.zeros(Game.max_sum+1, dtype=np.int64)
+    dealer_sums = np.zeros(Game.max_sum+1, dtype=np.int64)
+    with multiprocessing.Pool(n_workers) as pool:
+        for table_wins, table_losses, table_player_sums, table_dealer_sums in pool.imap_unordered(playTable, tasks):
+            wins += table_wins
+            losses += table_losses
+            player_sums += table_player_sums
+            dealer_sums += table_dealer_sums
+
+    print(f"After {wins + losses} games on {n_tables} tables the player has won {wins / (wins + losses) * 100}% of games.")
+    return wins, losses, player_sums, dealer_sums
+
     
 
 if __name__ == "__main__":
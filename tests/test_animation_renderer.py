@@ -0,0 +1,30 @@
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from AnimationRenderer import AnimationRenderer
+
+
+def referenceFrame(grid, label, cmap, vmin, vmax, title):
+    # the same figure drawn the normal way
+    fig = Figure(figsize=(8,6), dpi=100)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.set_title(title)
+    im = ax.matshow(grid, cmap=cmap, vmin=vmin, vmax=vmax)
+    fig.colorbar(im, ax=ax)
+    ax.annotate(
+        label, (0, 1), xycoords="axes fraction", xytext=(10, -10),
+        textcoords="offset points", ha="left", va="top")
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+
+def test_frame_matches_normal_draw():
+    rng = np.random.default_rng(0)
+    renderer = AnimationRenderer((7,10), title="Gridworld")
+    for step in range(3):
+        grid = rng.random((7,10))
+        frame = renderer.renderFrame(grid, f"step {step}")
+        expected = referenceFrame(grid, f"step {step}", 'coolwarm', 0, 1, "Gridworld")
+        np.testing.assert_array_equal(frame, expected)
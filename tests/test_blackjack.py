@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from blackjack import Deck, DeckEmptyException
+
+
+def test_getCards_is_not_changed_by_a_reshuffle():
+    deck = Deck(1)
+    cards = deck.getCards(10)
+    dealt = cards.copy()
+    deck.shuffle()
+    np.testing.assert_array_equal(cards, dealt)
+
+
+def test_finite_deck_deals_until_empty_by_default():
+    deck = Deck(1)
+    deck.getCards(51)
+    deck.checkPenetration()
+    deck.getCard()
+    deck.checkPenetration()
+    with pytest.raises(DeckEmptyException):
+        deck.getCard()
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Gridworld"))
+from gridworld3 import Gridworld
+
+
+def test_simulate_keeps_values_finite():
+    np.random.seed(0)
+    for random_start in (False, True):
+        gw = Gridworld(random_start=random_start, final_image=False)
+        gw.simulate(500)
+
+        assert np.isfinite(gw.action_values).all()
+        # values are bounded by the largest reward / (1 - gamma)
+        assert np.abs(gw.action_values).max() <= 10 / (1 - gw.gamma)
+        np.testing.assert_allclose(gw.state_sums, gw.action_values.sum(axis=-1).ravel())
+        assert not gw.episode_truncated.any()